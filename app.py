@@ -1,11 +1,20 @@
+import click
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
 from asgiref.wsgi import WsgiToAsgi
 import uvicorn
 
+import auth
+import catalogue_cache
+import coalesce
+import generation_cache
+import jobs
+import ratelimit
+import replica
+import tokens
 from config import Config
-from database import db
+from database import db, apply_sqlite_pragmas
 from routes import api_bp
 from promptify import promptify_bp
 
@@ -19,7 +28,18 @@ def create_app(config_class=Config):
     CORS(app)
 
     db.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            apply_sqlite_pragmas(engine, app.config['SQLITE_PRAGMAS'])
     migrate.init_app(app, db)
+    auth.init_app(app)
+    generation_cache.init_app(app)
+    coalesce.init_app(app)
+    ratelimit.init_app(app)
+    replica.init_app(app)
+    catalogue_cache.init_app(app)
+    tokens.init_app(app)
+    jobs.init_app(app)
     app.register_blueprint(api_bp, url_prefix='/')
     app.register_blueprint(promptify_bp, url_prefix='/promptify')
 
@@ -48,10 +68,85 @@ def create_app(config_class=Config):
         db.session.commit()
         print("Database seeded with initial users.")
 
+    @app.cli.command("compact-tokens")
+    @click.option('--batch-size', default=1000, show_default=True, help='Rows deleted per transaction.')
+    def compact_tokens(batch_size):
+        """Deletes expired rows from the token blacklist."""
+        from database import TokenBlacklist
+        deleted = TokenBlacklist.purge_expired(batch_size)
+        auth.get_auth_cache().revocations.compact_log()
+        print(f"Deleted {deleted} expired blacklisted tokens.")
+
+    @app.cli.command("archive-generations")
+    @click.option('--days', default=90, show_default=True, help='Archive generations older than this.')
+    @click.option('--batch-size', default=500, show_default=True, help='Generations moved per transaction.')
+    def archive_generations(days, batch_size):
+        """Moves the text of old generations to the archive table."""
+        from datetime import datetime, timedelta
+        from database import GeneratedPrompt
+        archived = GeneratedPrompt.archive_before(datetime.utcnow() - timedelta(days=days), batch_size)
+        print(f"Archived {archived} generations.")
+
+    @app.cli.command("rebuild-stats")
+    def rebuild_stats():
+        """Recomputes the prompt and user generation stats from the full history."""
+        from database import PromptStats, UserStats
+        PromptStats.rebuild()
+        UserStats.rebuild()
+        db.session.commit()
+        print("Generation stats rebuilt.")
+
+    @app.cli.command("refresh-hot-scores")
+    @click.option('--interval', default=0.0, show_default=True,
+                  help='Keep refreshing every INTERVAL seconds; 0 refreshes once.')
+    @click.option('--batch-size', default=1000, show_default=True, help='Prompts updated per transaction.')
+    def refresh_hot_scores(interval, batch_size):
+        """Recomputes the time-decayed hot ranking of shared prompts."""
+        import time
+        from database import Prompt
+        while True:
+            updated = Prompt.refresh_hot_scores(batch_size)
+            print(f"Refreshed the hot score of {updated} prompts.", flush=True)
+            if not interval:
+                break
+            time.sleep(interval)
+
+    @app.cli.command("reindex-search")
+    def reindex_search():
+        """Rebuilds the full-text search index of shared prompts."""
+        from search import rebuild_index
+        rebuild_index()
+        print("Search index rebuilt.")
+
+    @app.cli.command("sync-replica")
+    @click.option('--interval', default=0.0, show_default=True,
+                  help='Keep syncing every INTERVAL seconds; 0 syncs once.')
+    def sync_replica(interval):
+        """Copies the primary SQLite database to the replica."""
+        import time
+        if 'replica' not in db.engines:
+            raise click.ClickException("REPLICA_DATABASE_URL is not set.")
+        while True:
+            try:
+                replica.sync_sqlite_replica(db.engine, db.engines['replica'])
+            except ValueError as e:
+                raise click.ClickException(str(e))
+            if not interval:
+                break
+            time.sleep(interval)
+        print("Replica synced.")
+
     return app
 
+def create_asgi_app(app):
+    """Wraps the Flask app for uvicorn according to ASGI_MODE."""
+    if app.config['ASGI_MODE'] == 'native':
+        from asgi import NativeASGIApp
+        return NativeASGIApp(app)
+    return WsgiToAsgi(app)
+
 app = create_app()
-asgi_app = WsgiToAsgi(app)
+asgi_app = create_asgi_app(app)
 
 if __name__ == '__main__':
     with app.app_context():
@@ -0,0 +1,314 @@
+import asyncio
+import json
+import math
+import re
+from urllib.parse import parse_qs
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.http import unquote_etag
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import joinedload, selectinload
+from catalogue_cache import page_key
+from database import db, apply_sqlite_pragmas, CatalogueVersion, Prompt, GeneratedPrompt, GenerationJob, prompt_dicts
+from generation_cache import cache_key
+from ratelimit import ROUTE_CLASSES
+from routes import authenticate, etag_matches, prompt_etag, prompt_sort, validator_headers
+from pagination import PaginationError, keyset_page, page_result, parse_limit
+from services import MODEL_NAME, GenerationError, model, begin_generation, call_model_async, finish_generation
+from tokens import QuotaExceeded, TokenBudgetError
+from logger import logger
+
+# Async drivers used for the native mode, by sync dialect
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+}
+
+
+def async_database_url(url):
+    """Maps a sync SQLAlchemy URL onto the matching async driver."""
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.remote_addr = (scope.get('client') or (None,))[0]
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1') for name, value in scope['headers']}
+        self.args = {name: values[-1] for name, values in parse_qs(scope.get('query_string', b'').decode()).items()}
+
+
+class JSONResponse:
+    def __init__(self, body, status=200, headers=None):
+        if status == 304:
+            self.body = b''
+        elif isinstance(body, bytes):
+            self.body = body
+        else:
+            self.body = json.dumps(body, sort_keys=True).encode()
+        self.status = status
+        self.headers = headers or {}
+
+    async def send(self, send):
+        headers = [(b'content-length', str(len(self.body)).encode())]
+        if self.status != 304:
+            headers.append((b'content-type', b'application/json'))
+        headers += [(name.lower().encode(), str(value).encode()) for name, value in self.headers.items()]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+async def conditional(request, etag, build):
+    """Async counterpart of routes.conditional."""
+    headers = validator_headers(etag)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return JSONResponse(None, 304, headers)
+    response = await build()
+    if response.status == 200:
+        response.headers.update(headers)
+    return response
+
+
+def token_budget_error(e):
+    if isinstance(e, QuotaExceeded):
+        return JSONResponse({'error': str(e)}, 429, {'Retry-After': e.retry_after})
+    return JSONResponse({'error': str(e)}, 413)
+
+
+class NativeASGIApp:
+    """Natively async serving mode.
+
+    The hot endpoints below run as coroutines on the event loop, with their
+    reads through an async engine and the model call awaited, so a slow
+    generation does not hold a thread. They share their checks, queries and
+    serialization with the Flask views; the steps that go through Flask's
+    session (auth, the generation cache and lock, saving a generation) run
+    on threads within an app context. Every other route is passed to the
+    Flask app through the WsgiToAsgi bridge, which also serves all routes in
+    the default 'bridge' mode.
+    """
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.bridge = WsgiToAsgi(flask_app)
+        config = flask_app.config
+        self.engine = create_async_engine(
+            config.get('ASYNC_DATABASE_URI') or async_database_url(config['SQLALCHEMY_DATABASE_URI'])
+        )
+        apply_sqlite_pragmas(self.engine.sync_engine, config['SQLITE_PRAGMAS'])
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.replica_engine = self.replica_sessions = None
+        if config.get('REPLICA_DATABASE_URL'):
+            self.replica_engine = create_async_engine(
+                config.get('REPLICA_ASYNC_DATABASE_URI') or async_database_url(config['REPLICA_DATABASE_URL'])
+            )
+            apply_sqlite_pragmas(self.replica_engine.sync_engine, config['SQLITE_PRAGMAS'])
+            self.replica_sessions = async_sessionmaker(self.replica_engine, expire_on_commit=False)
+        # Generations are only served here with `sync=true`; otherwise the
+        # Flask route queues a job, so both modes answer the same way
+        self.routes = [
+            ('GET', re.compile(r'^/prompts/public$'), self.get_public_prompts, None),
+            ('GET', re.compile(r'^/prompts/(?P<prompt_id>\d+)$'), self.get_prompt, None),
+            ('POST', re.compile(r'^/prompts/(?P<prompt_id>\d+)/generate$'), self.generate_prompt,
+             lambda request: request.args.get('sync', 'false').lower() == 'true'),
+            ('GET', re.compile(r'^/jobs/(?P<job_id>[0-9a-f-]+)$'), self.get_job, None),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http':
+            for method, pattern, handler, accepts in self.routes:
+                match = pattern.match(scope['path'])
+                if match and scope['method'] == method:
+                    request = Request(scope)
+                    if accepts is not None and not accepts(request):
+                        break
+                    response = await self.dispatch(handler, request, match.groupdict())
+                    return await response.send(send)
+        return await self.bridge(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                if self.replica_engine is not None:
+                    await self.replica_engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def dispatch(self, handler, request, params):
+        limiter = self.flask_app.extensions['rate_limiter']
+        client = limiter.client_key(request.headers.get('x-access-token'), request.remote_addr)
+        wait = limiter.check(ROUTE_CLASSES.get(f'api.{handler.__name__}', 'default'), client)
+        if wait:
+            return JSONResponse({'message': 'Too many requests, please slow down.'}, 429, {'Retry-After': math.ceil(wait)})
+
+        user, error = await self.run_sync(authenticate, request.headers.get('x-access-token'))
+        if error is not None:
+            return JSONResponse(error, 401)
+        async with self.sessions() as session:
+            try:
+                return await handler(session, user, request, **params)
+            except Exception as e:
+                logger.error(f"Error handling {request.method} {request.path}: {e}")
+                return JSONResponse({'error': str(e)}, 500)
+
+    async def run_sync(self, fn, *args):
+        """Runs blocking Flask-side code on a thread, within an app context."""
+        def run():
+            with self.flask_app.app_context():
+                return fn(*args)
+        return await asyncio.to_thread(run)
+
+    async def get_public_prompts(self, session, current_user, request):
+        logger.info("Fetching public prompts.")
+        router = self.flask_app.extensions['replica_router']
+        use_replica = self.replica_sessions is not None and router.use_replica(current_user.id)
+        cache = self.flask_app.extensions['catalogue_cache']
+        cacheable = cache.applies(router, use_replica)
+        if cacheable:
+            version = cache.version()
+            key = page_key(request.path, request.args.items())
+            page = cache.get(version, key)
+            if page is not None:
+                etag, body = page
+
+                async def build():
+                    return JSONResponse(body)
+                return await conditional(request, etag, build)
+
+        if use_replica:
+            async with self.replica_sessions() as replica_session:
+                response = await self.public_prompts_page(replica_session, request)
+        else:
+            response = await self.public_prompts_page(session, request)
+        if cacheable and response.status == 200:
+            cache.set(version, key, (unquote_etag(response.headers['ETag'])[0], response.body))
+        return response
+
+    async def public_prompts_page(self, session, request):
+        version = await session.scalar(
+            select(CatalogueVersion.version).where(CatalogueVersion.name == CatalogueVersion.PUBLIC))
+        return await conditional(request, f"public-{version or 0}",
+                                 lambda: self.build_public_prompts_page(session, request))
+
+    async def build_public_prompts_page(self, session, request):
+        config = self.flask_app.config
+        keys, extra = prompt_sort(request.args.get('sort', 'newest'))
+        try:
+            limit = parse_limit(request.args.get('limit'), config['PAGE_SIZE'], config['MAX_PAGE_SIZE'])
+            statement = keyset_page(select(Prompt).where(Prompt.is_shared.is_(True)), keys,
+                                    request.args.get('cursor'), limit)
+        except PaginationError as e:
+            return JSONResponse({'message': str(e)}, 400)
+        prompts = (await session.scalars(statement.options(joinedload(Prompt.author)))).all()
+        prompts, next_cursor = page_result(prompt_dicts(prompts, *extra), keys, limit)
+        return JSONResponse({'prompts': prompts, 'next_cursor': next_cursor})
+
+    async def get_prompt(self, session, current_user, request, prompt_id):
+        prompt = await session.get(Prompt, int(prompt_id), options=[joinedload(Prompt.author)])
+        if prompt is None:
+            return JSONResponse({'message': 'Not Found'}, 404)
+        if not prompt.visible_to(current_user.id):
+            return JSONResponse({'message': 'Access forbidden!'}, 403)
+
+        async def build():
+            return JSONResponse(prompt.to_dict())
+        return await conditional(request, prompt_etag(prompt), build)
+
+    async def generate_prompt(self, session, current_user, request, prompt_id):
+        """Runs services.generate_for_prompt with the model call awaited.
+
+        The steps before and after the call run on threads; identical calls
+        are coalesced within and across processes like in the bridge mode.
+        """
+        fresh = request.args.get('fresh', 'false').lower() == 'true'
+        response, system_prompt, reservation = await self.run_sync(
+            self.begin_generation, int(prompt_id), current_user.id, fresh)
+        if response is not None:
+            return response
+
+        key = cache_key(system_prompt, MODEL_NAME)
+
+        async def call_and_cache():
+            data, usage = await call_model_async(system_prompt)
+            await self.run_sync(lambda: self.flask_app.extensions['generation_cache'].put(key, MODEL_NAME, data, usage))
+            return data, usage
+        coalescer = self.flask_app.extensions['generation_coalescer']
+        try:
+            data, usage, leader = await coalescer.run_async(key, call_and_cache, self.run_sync)
+            return await self.run_sync(self.finish_generation, int(prompt_id), current_user.id,
+                                       data, usage, leader, reservation)
+        except BaseException as e:
+            # Also when the request was cancelled; a failed save was rolled back
+            # with its thread's session, so the reservation is still held
+            await self.run_sync(self.flask_app.extensions['token_budget'].release, current_user.id, reservation)
+            if not isinstance(e, GenerationError):
+                raise
+            logger.error(f"Generation failed for prompt {prompt_id}: {e}")
+            return JSONResponse({'error': str(e)}, 502)
+
+    def begin_generation(self, prompt_id, user_id, fresh):
+        """Returns `(response, None, None)` when no model call is needed, else
+        `(None, system_prompt, reservation)` like services.begin_generation."""
+        prompt = db.session.get(Prompt, prompt_id)
+        if prompt is None:
+            return JSONResponse({'message': 'Not Found'}, 404), None, None
+        if not prompt.visible_to(user_id):
+            return JSONResponse({'message': 'Access forbidden!'}, 403), None, None
+        if not model:
+            return JSONResponse({"error": "Generative model not available. Check GOOGLE_API_KEY."}, 503), None, None
+        db.session.info['user_id'] = user_id
+        try:
+            generated_prompt, system_prompt, reservation = begin_generation(prompt, fresh=fresh, user_id=user_id)
+        except TokenBudgetError as e:
+            return token_budget_error(e), None, None
+        if generated_prompt is not None:
+            return JSONResponse(generated_prompt.to_dict()), None, None
+        return None, system_prompt, reservation
+
+    def finish_generation(self, prompt_id, user_id, data, usage, leader, reservation):
+        prompt = db.session.get(Prompt, prompt_id)
+        if prompt is None:
+            # Deleted during the model call
+            self.flask_app.extensions['token_budget'].release(user_id, reservation)
+            return JSONResponse({'message': 'Not Found'}, 404)
+        db.session.info['user_id'] = user_id
+        generated_prompt = finish_generation(prompt, data, usage, leader, user_id=user_id, reservation=reservation)
+        return JSONResponse(generated_prompt.to_dict())
+
+    async def get_job(self, session, current_user, request, job_id):
+        job = await session.get(GenerationJob, job_id)
+        if job is None:
+            return JSONResponse({'message': 'Not Found'}, 404)
+        if job.user_id != current_user.id:
+            return JSONResponse({'message': 'Access forbidden!'}, 403)
+
+        # Long-poll without holding a thread: wait on the local job event
+        # when this process runs the job, otherwise re-read the row
+        try:
+            wait = min(float(request.args.get('wait', 0)), self.flask_app.config['JOB_MAX_WAIT'])
+        except ValueError:
+            wait = 0
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        event = self.flask_app.extensions['job_queue'].local_event(job_id)
+        while not job.finished and loop.time() < deadline:
+            await asyncio.sleep(0.05 if event is not None else 0.25)
+            if event is None or event.is_set():
+                await session.refresh(job)
+
+        # Loads all that to_dict() reads, including an archived generation's
+        # text: a lazy load cannot run on the event loop
+        job = await session.scalar(
+            select(GenerationJob).where(GenerationJob.id == job_id)
+            .options(selectinload(GenerationJob.generated_prompt).selectinload(GeneratedPrompt.archive))
+            .execution_options(populate_existing=True))
+        return JSONResponse(job.to_dict())
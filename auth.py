@@ -0,0 +1,195 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime
+import jwt
+from flask import current_app
+from cache import TTLCache
+from database import db, User, TokenBlacklist
+from logger import logger
+
+
+class BloomFilter:
+    """A fixed-size Bloom filter over strings.
+
+    Membership tests can return false positives (at roughly `error_rate`) but
+    never false negatives, so a miss proves a token was not revoked.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationSet:
+    """In-memory view of TokenBlacklist used to check tokens without the DB.
+
+    Revoked jtis are kept in a Bloom filter; only a filter hit (a revoked token
+    or a rare false positive) falls back to an exact TokenBlacklist lookup.
+    Revocations are appended to a shared log file which every worker tails on
+    each check (one stat call), so a logout is seen by all workers at once.
+    The filter is also rebuilt from the table every `reload_interval` seconds.
+    """
+
+    def __init__(self, log_path, capacity=10000, error_rate=0.001, reload_interval=300):
+        self.log_path = log_path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.reload_interval = reload_interval
+        self._bloom = None
+        self._inode = None
+        self._offset = 0
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def _log_state(self):
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def _load(self):
+        # Taken before the query: a logout committed in between is then also
+        # read from the log (adding a jti twice is harmless), never skipped
+        inode, offset = self._log_state()
+        # Expired tokens fail verification anyway, so only live ones are kept
+        jtis = [jti for (jti,) in db.session.query(TokenBlacklist.jti)
+                .filter(TokenBlacklist.expires_at > datetime.utcnow())]
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self._inode, self._offset = inode, offset
+        self._bloom = bloom
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(jtis)} revoked tokens into the revocation filter.")
+
+    def _tail_log(self):
+        inode, size = self._log_state()
+        if inode != self._inode or size < self._offset:
+            # The log was compacted, reload everything from the table
+            self._load()
+        elif size > self._offset:
+            with open(self.log_path, 'rb') as log:
+                log.seek(self._offset)
+                data = log.read(size - self._offset)
+            # Only consume complete lines, a writer may be mid-append
+            end = data.rfind(b'\n') + 1
+            for jti in data[:end].decode().split():
+                self._bloom.add(jti)
+            self._offset += end
+        if self._bloom.count > 2 * self._bloom.capacity:
+            self._load()
+
+    def sync(self):
+        with self._lock:
+            if self._bloom is None or time.monotonic() - self._loaded_at > self.reload_interval:
+                self._load()
+            else:
+                self._tail_log()
+
+    def might_be_revoked(self, jti):
+        """Checks the filter only; False means the token is definitely live."""
+        self.sync()
+        return jti in self._bloom
+
+    def is_revoked(self, jti):
+        if not self.might_be_revoked(jti):
+            return False
+        return TokenBlacklist.query.filter_by(jti=jti).first() is not None
+
+    def revoke(self, jti):
+        """Publishes a revocation that is already committed to TokenBlacklist."""
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(jti)
+        with open(self.log_path, 'ab') as log:
+            log.write(jti.encode() + b'\n')
+
+    def compact_log(self):
+        """Replaces the shared log with an empty file.
+
+        Workers notice the new inode and reload from TokenBlacklist, which
+        already holds every revocation that was written to the old log.
+        """
+        tmp_path = f"{self.log_path}.{os.getpid()}.tmp"
+        open(tmp_path, 'wb').close()
+        os.replace(tmp_path, self.log_path)
+
+
+class AuthCache:
+    """Caches decoded tokens and user rows for auth_required."""
+
+    def __init__(self, app):
+        config = app.config
+        self.secret_key = config['SECRET_KEY']
+        self.token_ttl = config['AUTH_TOKEN_CACHE_TTL']
+        self.tokens = TTLCache(maxsize=config['AUTH_CACHE_SIZE'], ttl=self.token_ttl)
+        self.users = TTLCache(maxsize=config['AUTH_CACHE_SIZE'], ttl=config['AUTH_USER_CACHE_TTL'])
+        self.revocations = RevocationSet(
+            config['REVOCATION_LOG_PATH'],
+            capacity=config['REVOCATION_FILTER_CAPACITY'],
+            reload_interval=config['REVOCATION_RELOAD_INTERVAL'],
+        )
+
+    def decode_token(self, token):
+        """Decodes and verifies a token, memoizing the payload until it expires."""
+        data = self.tokens.get(token)
+        if data is None:
+            data = jwt.decode(token, self.secret_key, algorithms=["HS256"])
+            ttl = min(self.token_ttl, data.get('exp', 0) - time.time())
+            if ttl > 0:
+                self.tokens.set(token, data, ttl=ttl)
+        elif data.get('exp', 0) <= time.time():
+            self.tokens.pop(token)
+            raise jwt.ExpiredSignatureError('Signature has expired')
+        return data
+
+    def load_user(self, user_id):
+        """Returns the user attached to the current session.
+
+        Cached users are detached copies and are merged back without a query.
+        """
+        user = self.users.get(user_id)
+        if user is None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            db.session.expunge(user)
+            self.users.set(user_id, user)
+        return db.session.merge(user, load=False)
+
+    def is_revoked(self, jti):
+        return self.revocations.is_revoked(jti)
+
+    def revoke(self, token, jti):
+        self.tokens.pop(token)
+        self.revocations.revoke(jti)
+
+
+def init_app(app):
+    app.extensions['auth_cache'] = AuthCache(app)
+
+
+def get_auth_cache():
+    return current_app.extensions['auth_cache']
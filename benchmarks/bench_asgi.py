@@ -0,0 +1,172 @@
+"""Compares the WsgiToAsgi bridge with the native ASGI mode.
+
+Both apps are driven in-process (no sockets) against a temporary SQLite
+database, with the fake model standing in for Gemini:
+
+    python benchmarks/bench_asgi.py --requests 2000 --concurrency 200
+
+Reports requests/sec and p50/p99 latency for the public listing and for
+generations of distinct prompts. In bridge mode a generation is submitted as
+a job and long-polled until it finishes, like the web client does.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario.')
+    parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight at once.')
+    parser.add_argument('--prompts', type=int, default=500, help='Shared prompts to seed.')
+    parser.add_argument('--latency', type=float, default=0.5, help='Fake model latency in seconds.')
+    return parser.parse_args()
+
+
+async def call(app, method, path, token, query=''):
+    """Runs one request through an ASGI app and returns `(status, body)`."""
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': '',
+        'query_string': query.encode(),
+        'headers': [(b'host', b'bench'), (b'x-access-token', token.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': ('bench', 80),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    response = {'status': None, 'body': b''}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return response['status'], response['body']
+
+
+async def list_public(app, token, prompt_id):
+    status, _ = await call(app, 'GET', '/prompts/public', token)
+    return status == 200
+
+
+async def generate(app, token, prompt_id):
+    status, body = await call(app, 'POST', f'/prompts/{prompt_id}/generate', token, 'fresh=true&sync=true')
+    if status == 202:
+        job_id = json.loads(body)['job_id']
+        while True:
+            status, body = await call(app, 'GET', f'/jobs/{job_id}', token, 'wait=30')
+            if json.loads(body)['status'] in ('succeeded', 'failed'):
+                return json.loads(body)['status'] == 'succeeded'
+    return status == 200
+
+
+async def run_scenario(app, scenario, token, ids, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            ok = await scenario(app, token, ids[i % len(ids)])
+            latencies.append(time.perf_counter() - started)
+            failures += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'rps': total / elapsed,
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'failures': failures,
+    }
+
+
+async def measure(app, scenario, token, ids, args):
+    # Warm up connection pools and caches before timing
+    await run_scenario(app, scenario, token, ids, args.concurrency, args.concurrency)
+    return await run_scenario(app, scenario, token, ids, args.requests, args.concurrency)
+
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix='promptify-bench-')
+    os.environ['PROMPTIFY_FAKE_MODEL'] = '1'
+    os.environ['FAKE_MODEL_LATENCY'] = str(args.latency)
+    os.environ['REVOCATION_LOG_PATH'] = os.path.join(workdir, 'revoked_tokens.log')
+
+    import logging
+    import warnings
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+    from config import Config
+    from app import create_app, create_asgi_app
+    from database import db, User, Prompt
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        CATALOGUE_VERSION_PATH = os.path.join(workdir, 'catalogue.version')
+        GENERATION_QUEUE_SIZE = args.requests
+        # Measures serving throughput, not the rate limits or the daily quota
+        RATE_LIMIT_ENABLED = False
+        DAILY_TOKEN_QUOTA = 0
+
+    flask_app = create_app(BenchConfig)
+    with flask_app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@promptify.com', gender='other')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.flush()
+        for i in range(args.prompts):
+            db.session.add(Prompt(user_id=user.id, title=f'Prompt {i}', text=f'Benchmark prompt number {i}.',
+                                  is_shared=True))
+        db.session.commit()
+        ids = [prompt_id for prompt_id, in db.session.query(Prompt.id)]
+        token = flask_app.test_client().post('/login', auth=('bench', 'bench')).get_json()['token']
+
+    scenarios = [('GET /prompts/public', list_public), ('POST /prompts/<id>/generate', generate)]
+    print(f"{args.requests} requests per scenario, concurrency {args.concurrency}, "
+          f"model latency {args.latency * 1000:.0f} ms")
+    print(f"{'scenario':30} {'mode':8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'failed':>7}")
+    failed = 0
+    for name, scenario in scenarios:
+        for mode in ('bridge', 'native'):
+            flask_app.config['ASGI_MODE'] = mode
+            asgi_app = create_asgi_app(flask_app)
+            result = asyncio.run(measure(asgi_app, scenario, token, ids, args))
+            print(f"{name:30} {mode:8} {result['rps']:9.1f} {result['p50']:9.1f} {result['p99']:9.1f} "
+                  f"{result['failures']:7d}")
+            failed += result['failures']
+    if failed:
+        print(f"{failed} requests failed, the results are not comparable.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
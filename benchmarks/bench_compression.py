@@ -0,0 +1,143 @@
+"""Database size and scan time of GeneratedPrompt with and without compression.
+
+Builds the same synthetic generations three ways in SQLite files:
+
+    python benchmarks/bench_compression.py --rows 20000
+
+'plain' stores the text columns as TEXT (the previous schema),
+'compressed' stores them through compression.compress_text, and 'archived'
+also moves the text of all but the newest 10% of rows to the archive
+table. Reports the file size after VACUUM, the time of a full scan of
+generated_prompt (what history counts, stats and calibration pay), and the
+time to read and decode the text of random generations.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import compress_text, decompress_text, zstandard
+
+WORDS = ('the prompt model output clear specific audience example format step result improve context '
+         'tone length detail request answer response user list summary task goal style section '
+         'data explain include avoid concise structure').split()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000, help='Generations to store.')
+    parser.add_argument('--text-size', type=int, default=3000, help='Average generated text size in bytes.')
+    parser.add_argument('--reads', type=int, default=1000, help='Random generations read per run.')
+    return parser.parse_args()
+
+
+def paragraph(size):
+    words, length = [], 0
+    while length < size:
+        word = random.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words).capitalize() + '.'
+
+
+def build(mode, path, rows, text_size):
+    encode = (lambda value: value) if mode == 'plain' else compress_text
+    text_type = 'TEXT' if mode == 'plain' else 'BLOB'
+    connection = sqlite3.connect(path)
+    connection.executescript(f"""
+        CREATE TABLE generated_prompt (
+            id INTEGER PRIMARY KEY, prompt_id INTEGER NOT NULL, user_id INTEGER,
+            generated_text {text_type}, overall_score INTEGER, clarity INTEGER, specificity INTEGER,
+            effectiveness INTEGER, refined_prompt {text_type}, improvements_made JSON,
+            additional_suggestions JSON, prompt_token_count INTEGER, candidates_token_count INTEGER,
+            from_cache BOOLEAN NOT NULL DEFAULT 0, created_at DATETIME, archived BOOLEAN NOT NULL DEFAULT 0
+        );
+        CREATE INDEX ix_generated_prompt_prompt_created_at ON generated_prompt (prompt_id, created_at, id);
+        CREATE TABLE generated_prompt_archive (
+            generated_prompt_id INTEGER PRIMARY KEY, generated_text BLOB, refined_prompt BLOB,
+            improvements_made JSON, additional_suggestions JSON, archived_at DATETIME NOT NULL
+        );
+    """)
+    random.seed(7)
+    for start in range(0, rows, 1000):
+        batch = []
+        for i in range(start, min(start + 1000, rows)):
+            text = '\n\n'.join(paragraph(text_size // 4) for _ in range(4))
+            batch.append((i + 1, i % 500 + 1, encode(text), random.randint(1, 10), encode(paragraph(400)),
+                          '["Clarified the requested output format."]', f'2026-01-01 00:00:{i % 60:02d}'))
+        connection.executemany(
+            "INSERT INTO generated_prompt (id, prompt_id, generated_text, overall_score, refined_prompt, "
+            "improvements_made, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+    if mode == 'archived':
+        cutoff = int(rows * 0.9)
+        connection.execute(
+            "INSERT INTO generated_prompt_archive (generated_prompt_id, generated_text, refined_prompt, "
+            "improvements_made, archived_at) SELECT id, generated_text, refined_prompt, improvements_made, "
+            "'2026-01-01' FROM generated_prompt WHERE id <= ?", (cutoff,))
+        connection.execute(
+            "UPDATE generated_prompt SET generated_text = NULL, refined_prompt = NULL, improvements_made = NULL, "
+            "archived = 1 WHERE id <= ?", (cutoff,))
+    connection.commit()
+    connection.execute('VACUUM')
+    connection.close()
+
+
+def timed(fn, runs=5):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000
+
+
+def measure(mode, path, rows, reads):
+    # A small page cache, so scans read their pages through the OS
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA cache_size=-2000')
+    decode = (lambda value: value) if mode == 'plain' else decompress_text
+
+    def scan():
+        connection.execute(
+            "SELECT prompt_id, count(*), avg(overall_score) FROM generated_prompt GROUP BY prompt_id"
+        ).fetchall()
+
+    ids = random.Random(11).sample(range(1, rows + 1), min(reads, rows))
+
+    def read_details():
+        for row_id in ids:
+            text, refined, archived = connection.execute(
+                "SELECT generated_text, refined_prompt, archived FROM generated_prompt WHERE id = ?", (row_id,)
+            ).fetchone()
+            if archived:
+                text, refined = connection.execute(
+                    "SELECT generated_text, refined_prompt FROM generated_prompt_archive "
+                    "WHERE generated_prompt_id = ?", (row_id,)
+                ).fetchone()
+            decode(text), decode(refined)
+
+    result = {'size': os.path.getsize(path) / 1024 / 1024, 'scan': timed(scan), 'reads': timed(read_details)}
+    connection.close()
+    return result
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp(prefix='promptify-bench-')
+    print(f"{args.rows} generations of ~{args.text_size} bytes, codec: {'zstd' if zstandard else 'zlib'}")
+    print(f"{'mode':12} {'size MB':>9} {'scan ms':>9} {f'{args.reads} reads ms':>14}")
+    for mode in ('plain', 'compressed', 'archived'):
+        path = os.path.join(directory, f'{mode}.db')
+        build(mode, path, args.rows, args.text_size)
+        result = measure(mode, path, args.rows, args.reads)
+        print(f"{mode:12} {result['size']:9.1f} {result['scan']:9.1f} {result['reads']:14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""Write throughput of the SQLite settings under concurrent workers.
+
+Several worker processes, each with a few request threads, cast votes and
+create prompts through the Flask app against one SQLite file, like uvicorn
+workers sharing promptcraft.db:
+
+    python benchmarks/bench_write_contention.py --workers 4 --threads 4 --seconds 10
+
+'baseline' is the previous configuration (rollback journal, a pool of 10
+with pre-ping); 'tuned' is the current Config (WAL, busy_timeout,
+synchronous=NORMAL, mmap and a smaller pool without pre-ping). Reports
+writes/sec, p99 latency and failed requests (mostly "database is locked").
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes.')
+    parser.add_argument('--threads', type=int, default=4, help='Request threads per worker.')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration of each run.')
+    parser.add_argument('--prompts', type=int, default=200, help='Shared prompts to vote on.')
+    return parser.parse_args()
+
+
+def make_config(mode, path):
+    from config import Config, engine_options
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        RATE_LIMIT_ENABLED = False
+        REVOCATION_LOG_PATH = path + '.revoked'
+
+    if mode == 'baseline':
+        BenchConfig.SQLALCHEMY_ENGINE_OPTIONS = {'pool_size': 10, 'pool_recycle': 3600, 'pool_pre_ping': True}
+        BenchConfig.SQLITE_PRAGMAS = {}
+    else:
+        BenchConfig.SQLALCHEMY_ENGINE_OPTIONS = engine_options(BenchConfig.SQLALCHEMY_DATABASE_URI)
+    return BenchConfig
+
+
+def worker(mode, path, tokens, prompt_ids, seconds, results):
+    import threading
+    from app import create_app
+    flask_app = create_app(make_config(mode, path))
+    latencies, failures = [], []
+    deadline = time.monotonic() + seconds
+
+    def run(token):
+        client = flask_app.test_client()
+        headers = {'x-access-token': token}
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            if random.random() < 0.8:
+                response = client.post(f'/prompts/{random.choice(prompt_ids)}/vote', headers=headers,
+                                       json={'vote': random.choice([1, -1, 0])})
+            else:
+                response = client.post('/prompts', headers=headers, json={'text': 'Benchmark prompt', 'tags': 'bench'})
+            latencies.append(time.perf_counter() - started)
+            failures.append(response.status_code >= 500)
+
+    threads = [threading.Thread(target=run, args=(token,)) for token in tokens]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.put((latencies, sum(failures)))
+
+
+def run_mode(mode, args):
+    from app import create_app
+    from database import db, User, Prompt, Tag
+    path = os.path.join(tempfile.mkdtemp(prefix='promptify-bench-'), 'bench.db')
+    flask_app = create_app(make_config(mode, path))
+    with flask_app.app_context():
+        db.create_all()
+        users = []
+        for i in range(args.workers * args.threads + 1):
+            user = User(username=f'bench{i}', email=f'bench{i}@promptify.com')
+            user.set_password('bench')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all([Prompt(user_id=users[0].id, text=f'Prompt {i}', is_shared=True) for i in range(args.prompts)])
+        Tag.get_or_create(['bench'])
+        db.session.commit()
+        prompt_ids = [prompt_id for prompt_id, in db.session.query(Prompt.id)]
+        client = flask_app.test_client()
+        tokens = [client.post('/login', auth=(user.username, 'bench')).get_json()['token'] for user in users[1:]]
+        db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(mode, path, tokens[i::args.workers], prompt_ids, args.seconds, results))
+        for i in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    latencies, failures = [], 0
+    for _ in processes:
+        worker_latencies, worker_failures = results.get()
+        latencies += worker_latencies
+        failures += worker_failures
+    for process in processes:
+        process.join()
+
+    latencies.sort()
+    return {
+        'wps': (len(latencies) - failures) / args.seconds,
+        'p50': statistics.median(latencies) * 1000,
+        'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        'failures': failures,
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault('PROMPTIFY_FAKE_MODEL', '1')
+    import logging
+    import warnings
+    logging.disable(logging.CRITICAL)
+    warnings.simplefilter('ignore')
+
+    print(f"{args.workers} workers x {args.threads} threads, {args.seconds:.0f}s per run, 80% votes / 20% creates")
+    print(f"{'mode':10} {'writes/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'failed':>7}")
+    for mode in ('baseline', 'tuned'):
+        result = run_mode(mode, args)
+        print(f"{mode:10} {result['wps']:9.1f} {result['p50']:9.1f} {result['p99']:9.1f} {result['failures']:7d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from functools import wraps
+from flask import current_app, make_response, request
+from sqlalchemy import event
+from cache import TTLCache
+from database import db, RoutingSession
+from logger import logger
+
+
+class SQLitePageStore:
+    """Pages shared by the worker processes through a SQLite file.
+
+    Rows of older catalogue versions are unreachable and purged from time to
+    time.
+    """
+
+    def __init__(self, path, ttl, purge_every=200):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._puts = 0
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS catalogue_page "
+                "(key TEXT PRIMARY KEY, version TEXT NOT NULL, etag TEXT NOT NULL, "
+                "body BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, version, key):
+        row = self._connection().execute(
+            "SELECT etag, body FROM catalogue_page WHERE key = ? AND version = ? AND stored_at > ?",
+            (key, version, time.time() - self.ttl),
+        ).fetchone()
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def set(self, version, key, page):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO catalogue_page (key, version, etag, body, stored_at) VALUES (?, ?, ?, ?, ?)",
+            (key, version, page[0], page[1], time.time()),
+        )
+        self._puts += 1
+        if self._puts % self.purge_every == 0:
+            connection.execute("DELETE FROM catalogue_page WHERE version != ? OR stored_at <= ?",
+                               (version, time.time() - self.ttl))
+
+
+class CatalogueCache:
+    """Pre-encoded JSON pages of the public listing and search.
+
+    Pages are cached as `(etag, body)` under the current catalogue version,
+    a random token kept in a file shared by the workers. A commit that
+    changes the public catalogue writes a new token; every worker notices it
+    on its next lookup (one stat call) and stops serving older pages. A page
+    built while the version changed is stored under the old version, so it
+    is never served.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.enabled = config['CATALOGUE_CACHE_SIZE'] > 0
+        self.version_path = config['CATALOGUE_VERSION_PATH']
+        self.memory = TTLCache(maxsize=config['CATALOGUE_CACHE_SIZE'], ttl=config['CATALOGUE_CACHE_TTL'])
+        self.shared = None
+        if config['CATALOGUE_CACHE_BACKEND'] == 'sqlite':
+            self.shared = SQLitePageStore(config['CATALOGUE_CACHE_PATH'], config['CATALOGUE_CACHE_TTL'])
+        self._file_state = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """Returns the current catalogue version token."""
+        try:
+            stat = os.stat(self.version_path)
+            file_state = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            file_state = None
+        with self._lock:
+            if file_state != self._file_state:
+                self.memory.clear()
+                self._file_state = file_state
+                self._version = self._read_version() if file_state else ''
+            return self._version
+
+    def _read_version(self):
+        try:
+            with open(self.version_path) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return ''
+
+    def invalidate(self):
+        """Publishes a new catalogue version to every worker."""
+        tmp_path = f"{self.version_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, self.version_path)
+        self.memory.clear()
+
+    def applies(self, replica_router, use_replica):
+        """Tells whether a request's pages may be served from and stored in the cache.
+
+        Users whose reads were kept on the primary after a write bypass it,
+        as it may hold replica pages.
+        """
+        return self.enabled and (use_replica or not replica_router.enabled)
+
+    def get(self, version, key):
+        page = self.memory.get((version, key))
+        if page is None and self.shared is not None:
+            try:
+                page = self.shared.get(version, key)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to read the shared catalogue cache: {e}")
+            if page is not None:
+                self.memory.set((version, key), page)
+        return page
+
+    def set(self, version, key, page):
+        self.memory.set((version, key), page)
+        if self.shared is not None:
+            try:
+                self.shared.set(version, key, page)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write the shared catalogue cache: {e}")
+
+
+def page_key(path, args):
+    """Cache key of a page: its path and sorted query arguments."""
+    return f"{path}?{'&'.join(f'{name}={value}' for name, value in sorted(args))}"
+
+
+def cached_catalogue_page(f):
+    """Serves a public catalogue view from the CatalogueCache.
+
+    Goes below read_replica, which tells whether the request may use the
+    cache (see CatalogueCache.applies). A hit is answered from the stored
+    bytes without touching the database.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        cache = get_catalogue_cache()
+        replica_router = current_app.extensions['replica_router']
+        if not cache.applies(replica_router, db.session.info.get('use_replica', False)):
+            return f(*args, **kwargs)
+
+        version = cache.version()
+        key = page_key(request.path, request.args.items(multi=True))
+        page = cache.get(version, key)
+        if page is not None:
+            etag, body = page
+            if request.if_none_match.contains_weak(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.response_class(body, mimetype='application/json')
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+
+        response = make_response(f(*args, **kwargs))
+        etag, _ = response.get_etag()
+        if response.status_code == 200 and etag:
+            cache.set(version, key, (etag, response.get_data()))
+        return response
+    return decorated
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _announce_catalogue_change(session):
+    if session.info.pop('catalogue_changed', False):
+        get_catalogue_cache().invalidate()
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_catalogue_change(session):
+    session.info.pop('catalogue_changed', None)
+
+
+def init_app(app):
+    app.extensions['catalogue_cache'] = CatalogueCache(app)
+
+
+def get_catalogue_cache():
+    return current_app.extensions['catalogue_cache']
@@ -0,0 +1,208 @@
+import asyncio
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, OperationalError
+from database import db, GenerationLock, GenerationCacheEntry
+from logger import logger
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one, within a process."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        """Runs `fn` once per key at a time; concurrent callers share its outcome.
+
+        Returns `(result, leader)`, where `leader` tells whether this caller
+        actually ran `fn`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+
+        try:
+            call.result = fn()
+            return call.result, True
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight:
+    """Collapses concurrent awaits of the same key into one call, on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        """Returns `(result, leader)`, like SingleFlight.do."""
+        future = self._calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), False
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            future.set_result(result)
+            return result, True
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._calls[key]
+            if not future.done():
+                from services import GenerationError
+                # The leader was cancelled; its followers must not wait forever
+                future.set_exception(GenerationError("The shared generation was cancelled, please retry."))
+            # Mark any exception as retrieved when nobody else was waiting
+            future.exception()
+
+
+class GenerationCoalescer:
+    """Deduplicates identical in-flight model calls across threads and processes.
+
+    Threads of one process share a call through SingleFlight. Across worker
+    processes the first caller takes a row in the GenerationLock table; the
+    others wait for the leader's response to appear in the generation cache,
+    and take over if the lock is released or expires without one.
+    run_async() is the same for the native ASGI mode, with the model call
+    awaited on the event loop.
+    """
+
+    def __init__(self, app):
+        self.lock_ttl = app.config['GENERATION_LOCK_TTL']
+        self.poll_interval = app.config['GENERATION_LOCK_POLL_INTERVAL']
+        self._flight = SingleFlight()
+        self._async_flight = AsyncSingleFlight()
+
+    def run(self, key, fn):
+        """Returns `(data, usage, leader)` for the model call `fn` keyed by `key`.
+
+        `fn` must store its response in the generation cache under `key`.
+        """
+        (data, usage, leader), first = self._flight.do(key, lambda: self._run_across_processes(key, fn))
+        return data, usage, leader and first
+
+    async def run_async(self, key, fn, run_sync):
+        """Awaitable run(), where `fn` is a coroutine function.
+
+        `run_sync(f, *args)` must run the blocking lock table steps off the
+        event loop, within an app context.
+        """
+        (data, usage, leader), first = await self._async_flight.do(
+            key, lambda: self._run_across_processes_async(key, fn, run_sync))
+        return data, usage, leader and first
+
+    def _run_across_processes(self, key, fn):
+        started_at = datetime.utcnow()
+        while True:
+            owner = self._acquire(key)
+            if owner is not None:
+                try:
+                    data, usage = fn()
+                    return data, usage, True
+                finally:
+                    self._release(key, owner)
+            result = self._wait_for_result(key, started_at)
+            if result is not None:
+                return (*result, False)
+            # The leader gave up without a result, try to take over
+
+    async def _run_across_processes_async(self, key, fn, run_sync):
+        started_at = datetime.utcnow()
+        while True:
+            owner = await run_sync(self._acquire, key)
+            if owner is not None:
+                try:
+                    data, usage = await fn()
+                    return data, usage, True
+                finally:
+                    await run_sync(self._release, key, owner)
+            # Holds a thread while another process makes the call, as in bridge mode
+            result = await run_sync(self._wait_for_result, key, started_at)
+            if result is not None:
+                return (*result, False)
+
+    def _wait_for_result(self, key, started_at):
+        """Polls while another caller holds the lock; returns its `(data, usage)` or None."""
+        logger.info(f"Waiting for an in-flight generation in another process ({key[:12]}).")
+        while self._locked(key):
+            entry = self._result(key, started_at)
+            if entry is not None:
+                return entry.response, entry.usage()
+            time.sleep(self.poll_interval)
+        entry = self._result(key, started_at)
+        return None if entry is None else (entry.response, entry.usage())
+
+    def _acquire(self, key):
+        owner = str(uuid.uuid4())
+        now = datetime.utcnow()
+        for _ in range(2):
+            try:
+                try:
+                    db.session.add(GenerationLock(key=key, owner=owner, expires_at=now + timedelta(seconds=self.lock_ttl)))
+                    db.session.commit()
+                    return owner
+                except IntegrityError:
+                    db.session.rollback()
+                # Take over a lock whose holder died before releasing it
+                stale = GenerationLock.query.filter(GenerationLock.key == key, GenerationLock.expires_at < now) \
+                    .delete(synchronize_session=False)
+                db.session.commit()
+            except OperationalError as e:
+                # SQLite reports a contended write as "database is locked";
+                # wait for the other caller's result instead of failing
+                db.session.rollback()
+                logger.warning(f"Could not take the generation lock for {key}: {e}")
+                return None
+            if not stale:
+                return None
+        return None
+
+    def _release(self, key, owner):
+        db.session.rollback()
+        GenerationLock.query.filter_by(key=key, owner=owner).delete(synchronize_session=False)
+        db.session.commit()
+
+    def _locked(self, key):
+        db.session.rollback()
+        return db.session.query(GenerationLock.key) \
+            .filter(GenerationLock.key == key, GenerationLock.expires_at >= datetime.utcnow()) \
+            .first() is not None
+
+    def _result(self, key, started_at):
+        return GenerationCacheEntry.query \
+            .filter(GenerationCacheEntry.key == key, GenerationCacheEntry.created_at >= started_at) \
+            .first()
+
+
+def init_app(app):
+    app.extensions['generation_coalescer'] = GenerationCoalescer(app)
+
+
+def get_coalescer():
+    return current_app.extensions['generation_coalescer']
@@ -0,0 +1,83 @@
+import threading
+import zlib
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+try:
+    import zstandard
+except ImportError:  # zlib is used when zstandard is not installed
+    zstandard = None
+
+# First byte of a stored value, naming its encoding
+RAW = b'\x00'
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+
+# Shorter values do not gain enough to be worth compressing
+MIN_COMPRESS_SIZE = 128
+
+# zstd contexts are reused per thread; they may not be shared between threads
+_zstd = threading.local()
+
+
+def _zstd_compressor():
+    if not hasattr(_zstd, 'compressor'):
+        _zstd.compressor = zstandard.ZstdCompressor(level=6)
+    return _zstd.compressor
+
+
+def _zstd_decompressor():
+    if not hasattr(_zstd, 'decompressor'):
+        _zstd.decompressor = zstandard.ZstdDecompressor()
+    return _zstd.decompressor
+
+
+def compress_text(text):
+    """Encodes `text` as a marker byte followed by its (compressed) UTF-8 bytes."""
+    if text is None:
+        return None
+    data = text.encode('utf-8')
+    if len(data) >= MIN_COMPRESS_SIZE:
+        if zstandard is not None:
+            compressed, marker = _zstd_compressor().compress(data), ZSTD
+        else:
+            compressed, marker = zlib.compress(data, 6), ZLIB
+        if len(compressed) < len(data):
+            return marker + compressed
+    return RAW + data
+
+
+def decompress_text(value):
+    """Decodes a value written by compress_text.
+
+    Values stored before compression was introduced come back as str, or as
+    bytes without a marker, and are returned as they are.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    marker, data = value[:1], value[1:]
+    if marker == ZLIB:
+        return zlib.decompress(data).decode('utf-8')
+    if marker == ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read this value: pip install zstandard")
+        return _zstd_decompressor().decompress(data).decode('utf-8')
+    if marker == RAW:
+        return data.decode('utf-8')
+    return value.decode('utf-8')
+
+
+class CompressedText(TypeDecorator):
+    """Text stored compressed in a binary column.
+
+    New values are compressed with zstd when the zstandard package is
+    installed, otherwise with zlib; either is read back transparently.
+    """
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return compress_text(value)
+
+    def process_result_value(self, value, dialect):
+        return decompress_text(value)
@@ -4,13 +4,138 @@ from dotenv import load_dotenv
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '.env'))
 
+def database_url():
+    url = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'promptcraft.db')
+    # Some hosts still hand out the scheme SQLAlchemy dropped in 1.4
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+def engine_options(url):
+    """Returns the SQLAlchemy engine options suited to the database at `url`."""
+    if url.startswith('sqlite'):
+        if url in ('sqlite://', 'sqlite:///') or ':memory:' in url:
+            return {}
+        # Connections are local file handles: nothing to pre-ping or recycle,
+        # and writers serialize on the database lock, so a small pool will do
+        return {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+            'connect_args': {'check_same_thread': False},
+        }
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'promptcraft.db')
+    SQLALCHEMY_DATABASE_URI = database_url()
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_size': 10,
-        'pool_recycle': 3600,
-        'pool_pre_ping': True
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # Set on every new SQLite connection. WAL lets readers run alongside the
+    # writer, and busy_timeout makes writers queue for the lock instead of
+    # failing with "database is locked"
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 16384)),
+        'temp_store': 'MEMORY',
+    }
+    # Read-only endpoints are served from this replica when set, e.g. a
+    # streaming replica, or locally a copy kept by `flask sync-replica`.
+    # A user's reads stay on the primary for REPLICA_STICKY_SECONDS after
+    # they write, so they see their own changes despite replication lag
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {
+        'replica': dict(engine_options(REPLICA_DATABASE_URL), url=REPLICA_DATABASE_URL),
+    } if REPLICA_DATABASE_URL else {}
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+    REPLICA_ASYNC_DATABASE_URI = os.environ.get('REPLICA_ASYNC_DATABASE_URI')
+    # 'bridge' serves every route through WsgiToAsgi; 'native' runs the hot
+    # endpoints as coroutines on an async engine (see asgi.py)
+    ASGI_MODE = os.environ.get('ASGI_MODE', 'bridge')
+    ASYNC_DATABASE_URI = os.environ.get('ASYNC_DATABASE_URI')
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 20))
+    MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 100))
+    # Prompts need this many scored generations to appear on the leaderboard
+    LEADERBOARD_MIN_GENERATIONS = int(os.environ.get('LEADERBOARD_MIN_GENERATIONS', 3))
+    # NDJSON export streams this many rows per fetch; import commits this
+    # many prompts per transaction and reports at most IMPORT_MAX_ERRORS lines
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 1000))
+    IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 100))
+    # Generation jobs run on a bounded thread pool in each worker process
+    GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 4))
+    GENERATION_QUEUE_SIZE = int(os.environ.get('GENERATION_QUEUE_SIZE', 64))
+    GENERATION_MAX_RETRIES = int(os.environ.get('GENERATION_MAX_RETRIES', 2))
+    GENERATION_RETRY_BACKOFF = float(os.environ.get('GENERATION_RETRY_BACKOFF', 2.0))
+    JOB_MAX_WAIT = float(os.environ.get('JOB_MAX_WAIT', 30))
+    # Batch generations call the model concurrently, within a per-process
+    # rate limit on model calls (calls per second, 0 disables it)
+    GENERATION_BATCH_MAX_SIZE = int(os.environ.get('GENERATION_BATCH_MAX_SIZE', 50))
+    GENERATION_BATCH_CONCURRENCY = int(os.environ.get('GENERATION_BATCH_CONCURRENCY', 8))
+    MODEL_RATE_LIMIT = float(os.environ.get('MODEL_RATE_LIMIT', 5))
+    MODEL_RATE_BURST = int(os.environ.get('MODEL_RATE_BURST', 10))
+    # Request rate limits as 'count/period', per client (user or IP) and for
+    # all clients together, by route class; an empty value disables a limit
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', '1') == '1'
+    RATE_LIMITS = {
+        'generate': os.environ.get('RATE_LIMIT_GENERATE', '20/minute'),
+        'search': os.environ.get('RATE_LIMIT_SEARCH', '60/minute'),
+        'default': os.environ.get('RATE_LIMIT_DEFAULT', '300/minute'),
+    }
+    GLOBAL_RATE_LIMITS = {
+        'generate': os.environ.get('GLOBAL_RATE_LIMIT_GENERATE', '600/minute'),
+        'search': os.environ.get('GLOBAL_RATE_LIMIT_SEARCH', '6000/minute'),
     }
+    # 'memory' keeps buckets per process; 'sqlite' shares them between workers
+    RATE_LIMIT_STORE = os.environ.get('RATE_LIMIT_STORE', 'memory')
+    RATE_LIMIT_STORE_PATH = os.environ.get('RATE_LIMIT_STORE_PATH') or os.path.join(basedir, 'ratelimit.db')
+    RATE_LIMIT_SYNC_INTERVAL = float(os.environ.get('RATE_LIMIT_SYNC_INTERVAL', 0.5))
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS', 100000))
+    # Token guardrails: prompts are estimated before the model call, and
+    # each user may spend DAILY_TOKEN_QUOTA tokens per UTC day (0 disables it).
+    # A call reserves its prompt plus COMPLETION_TOKEN_RESERVE tokens for the
+    # response until its actual usage is recorded
+    MAX_PROMPT_TOKENS = int(os.environ.get('MAX_PROMPT_TOKENS', 8000))
+    PROMPT_OVERSIZE_POLICY = os.environ.get('PROMPT_OVERSIZE_POLICY', 'reject')  # reject or truncate
+    DAILY_TOKEN_QUOTA = int(os.environ.get('DAILY_TOKEN_QUOTA', 200000))
+    COMPLETION_TOKEN_RESERVE = int(os.environ.get('COMPLETION_TOKEN_RESERVE', 2048))
+    TOKEN_CALIBRATION_SAMPLE = int(os.environ.get('TOKEN_CALIBRATION_SAMPLE', 200))
+    TOKEN_CALIBRATION_INTERVAL = int(os.environ.get('TOKEN_CALIBRATION_INTERVAL', 3600))
+    # Content-addressed cache of model responses
+    GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 7 * 24 * 3600))
+    GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', 50000))
+    GENERATION_CACHE_MEMORY_SIZE = int(os.environ.get('GENERATION_CACHE_MEMORY_SIZE', 512))
+    GENERATION_CACHE_EVICT_EVERY = int(os.environ.get('GENERATION_CACHE_EVICT_EVERY', 100))
+    # Cache hits are counted in memory and written out this often (seconds)
+    GENERATION_CACHE_HIT_FLUSH_INTERVAL = float(os.environ.get('GENERATION_CACHE_HIT_FLUSH_INTERVAL', 30))
+    # Identical in-flight generations are coalesced through a lock table
+    GENERATION_LOCK_TTL = int(os.environ.get('GENERATION_LOCK_TTL', 180))
+    GENERATION_LOCK_POLL_INTERVAL = float(os.environ.get('GENERATION_LOCK_POLL_INTERVAL', 0.2))
+    TAG_FACETS_SIZE = int(os.environ.get('TAG_FACETS_SIZE', 100))
+    TAG_FACETS_CACHE_TTL = int(os.environ.get('TAG_FACETS_CACHE_TTL', 300))
+    # Pre-encoded pages of the public listing and search, per worker and
+    # optionally in a SQLite file shared by the workers ('sqlite' backend).
+    # Catalogue changes are announced to all workers by rewriting the version
+    # file; with a read replica, a page may lag for up to CATALOGUE_CACHE_TTL
+    CATALOGUE_CACHE_SIZE = int(os.environ.get('CATALOGUE_CACHE_SIZE', 1024))  # 0 disables the cache
+    CATALOGUE_CACHE_TTL = int(os.environ.get('CATALOGUE_CACHE_TTL', 300))
+    CATALOGUE_CACHE_BACKEND = os.environ.get('CATALOGUE_CACHE_BACKEND', 'memory')
+    CATALOGUE_CACHE_PATH = os.environ.get('CATALOGUE_CACHE_PATH') or os.path.join(basedir, 'catalogue_cache.db')
+    CATALOGUE_VERSION_PATH = os.environ.get('CATALOGUE_VERSION_PATH') or os.path.join(basedir, 'catalogue.version')
+    # Auth cache: decoded tokens and users are kept in memory, revocations
+    # are shared between workers through an append-only log file
+    AUTH_CACHE_SIZE = int(os.environ.get('AUTH_CACHE_SIZE', 10000))
+    AUTH_TOKEN_CACHE_TTL = int(os.environ.get('AUTH_TOKEN_CACHE_TTL', 300))
+    AUTH_USER_CACHE_TTL = int(os.environ.get('AUTH_USER_CACHE_TTL', 60))
+    REVOCATION_LOG_PATH = os.environ.get('REVOCATION_LOG_PATH') or os.path.join(basedir, 'revoked_tokens.log')
+    REVOCATION_FILTER_CAPACITY = int(os.environ.get('REVOCATION_FILTER_CAPACITY', 100000))
+    REVOCATION_RELOAD_INTERVAL = int(os.environ.get('REVOCATION_RELOAD_INTERVAL', 300))
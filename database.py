@@ -1,8 +1,44 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from sqlalchemy import case, event, func, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from compression import CompressedText
 
-db = SQLAlchemy()
+
+class RoutingSession(Session):
+    """Session that can send its reads to the 'replica' bind.
+
+    Reads go to the replica while `use_replica` is set in the session's
+    info (see replica.read_replica); flushes and UPDATE/DELETE statements
+    always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('use_replica') and not self._flushing \
+                and clause is not None and clause.is_select:
+            engine = self._db.engines.get('replica')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    """Runs the given PRAGMAs on each new connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -18,23 +54,173 @@ class User(db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
 
+prompt_tags = db.Table(
+    'prompt_tag',
+    db.Column('prompt_id', db.Integer, db.ForeignKey('prompt.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True),
+    db.Index('ix_prompt_tag_tag_id', 'tag_id', 'prompt_id'),
+)
+
+
+# Weight of age in the hot ranking of shared prompts, as in Hacker News
+HOT_GRAVITY = 1.8
+
+
+def hot_score(score, created_at, now=None):
+    """Vote score decayed by age: `(score + 1) / (age in hours + 2) ** HOT_GRAVITY`."""
+    now = now or datetime.utcnow()
+    age_hours = max((now - (created_at or now)).total_seconds() / 3600, 0)
+    return (score + 1) / (age_hours + 2) ** HOT_GRAVITY
+
+
+def parse_tags(raw):
+    """Parses a comma-separated tag string into unique, normalized tag names."""
+    names = []
+    for name in (raw or '').split(','):
+        name = name.strip().lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+class Tag(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+
+    @staticmethod
+    def get_or_create(names):
+        """Returns the Tag rows for `names`, creating the missing ones."""
+        if not names:
+            return []
+        existing = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))}
+        tags = []
+        for name in names:
+            tag = existing.get(name)
+            if tag is None:
+                tag = Tag(name=name)
+                db.session.add(tag)
+            tags.append(tag)
+        return tags
+
+    @staticmethod
+    def facet_counts(limit):
+        """Returns `(name, count)` pairs of the tags used by shared prompts."""
+        count = func.count(prompt_tags.c.prompt_id).label('count')
+        return db.session.query(Tag.name, count) \
+            .join(prompt_tags, prompt_tags.c.tag_id == Tag.id) \
+            .join(Prompt, Prompt.id == prompt_tags.c.prompt_id) \
+            .filter(Prompt.is_shared.is_(True)) \
+            .group_by(Tag.id, Tag.name) \
+            .order_by(count.desc(), Tag.name) \
+            .limit(limit).all()
+
+
 class Prompt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     title = db.Column(db.String(255), default='', nullable=False)
     text = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped by every change, including vote counts; the prompt's ETag derives from it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     intended_use = db.Column(db.String(200))
     target_audience = db.Column(db.String(200))
     expected_outcome = db.Column(db.String(200))
-    tags = db.Column(db.String(200)) # Simple comma-separated string for now
+    tags = db.Column(db.String(200)) # Comma-separated string as entered; normalized into tag_list
     is_shared = db.Column(db.Boolean, default=False, nullable=False)
+    # Vote counters, kept in step with PromptVote by apply_vote_change()
+    upvotes = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    downvotes = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    score = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    # hot_score() of shared prompts, set when shared and refreshed by
+    # refresh_hot_scores(). Left out of to_dict(): it changes without
+    # updated_at, which the prompt's ETag derives from
+    hot_score = db.Column(db.Float, default=0, nullable=False, server_default='0')
     generated_prompts = db.relationship('GeneratedPrompt', backref='prompt', lazy=True, cascade="all, delete-orphan")
     votes = db.relationship('PromptVote', backref='prompt', lazy=True, cascade="all, delete-orphan")
+    stats = db.relationship('PromptStats', back_populates='prompt', uselist=False, lazy=True, cascade="all, delete-orphan")
+    tag_list = db.relationship('Tag', secondary=prompt_tags, lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_prompt_is_shared_score', 'is_shared', 'score', 'id'),
+        db.Index('ix_prompt_is_shared_created_at', 'is_shared', 'created_at', 'id'),
+        db.Index('ix_prompt_user_created_at', 'user_id', 'created_at', 'id'),
+        db.Index('ix_prompt_is_shared_hot_score', 'is_shared', 'hot_score', 'id'),
+    )
+
+    @staticmethod
+    def apply_vote_change(prompt_id, old_vote, new_vote):
+        """Updates the vote counters of a prompt inside the current transaction.
+
+        The counters are incremented in SQL rather than read-modify-written, so
+        concurrent votes on the same prompt cannot lose updates.
+        """
+        upvotes = int(new_vote == 1) - int(old_vote == 1)
+        downvotes = int(new_vote == -1) - int(old_vote == -1)
+        if not upvotes and not downvotes:
+            return
+        Prompt.query.filter_by(id=prompt_id).update({
+            Prompt.upvotes: Prompt.upvotes + upvotes,
+            Prompt.downvotes: Prompt.downvotes + downvotes,
+            Prompt.score: Prompt.score + upvotes - downvotes,
+        })
+        CatalogueVersion.bump(db.session)
+
+    @staticmethod
+    def refresh_hot_scores(batch_size=1000):
+        """Recomputes hot_score of every shared prompt, committing after each batch.
+
+        The rows are updated in SQL without touching updated_at, so prompt
+        ETags stay valid; the catalogue version is bumped with the last
+        batch. Returns the number of prompts updated.
+        """
+        now = datetime.utcnow()
+        table = Prompt.__table__
+        statement = table.update().where(table.c.id == db.bindparam('prompt_id')) \
+            .values(hot_score=db.bindparam('hot_score'), updated_at=table.c.updated_at)
+        updated, last_id = 0, 0
+        while True:
+            rows = db.session.query(Prompt.id, Prompt.score, Prompt.created_at) \
+                .filter(Prompt.is_shared.is_(True), Prompt.id > last_id) \
+                .order_by(Prompt.id).limit(batch_size).all()
+            if rows:
+                db.session.execute(statement, [
+                    {'prompt_id': prompt_id, 'hot_score': hot_score(score, created_at, now)}
+                    for prompt_id, score, created_at in rows
+                ])
+                updated += len(rows)
+                last_id = rows[-1].id
+            if len(rows) < batch_size:
+                CatalogueVersion.bump(db.session)
+                db.session.commit()
+                return updated
+            db.session.commit()
+
+    def set_tags(self, raw):
+        """Sets the tag string and the normalized tags it contains."""
+        self.tags = raw
+        self.tag_list = Tag.get_or_create(parse_tags(raw))
+
+    def visible_to(self, user_id):
+        """Shared prompts can be read and generated by anyone, others by their author."""
+        return self.is_shared or self.user_id == user_id
+
+    @staticmethod
+    def tag_filter(names, match_all=True):
+        """Builds a filter on exact tag names through the tag index.
+
+        With `match_all` a prompt must carry every tag (AND), otherwise any
+        one of them (OR).
+        """
+        tagged = db.session.query(prompt_tags.c.prompt_id) \
+            .join(Tag, Tag.id == prompt_tags.c.tag_id) \
+            .filter(Tag.name.in_(names))
+        if match_all:
+            tagged = tagged.group_by(prompt_tags.c.prompt_id) \
+                .having(func.count(prompt_tags.c.tag_id) == len(names))
+        return Prompt.id.in_(tagged)
 
     def to_dict(self):
-        upvotes = sum(1 for v in self.votes if v.vote == 1)
-        downvotes = sum(1 for v in self.votes if v.vote == -1)
         return {
             'id': self.id,
             'author': self.author.username,
@@ -46,10 +232,71 @@ class Prompt(db.Model):
             'tags': self.tags,
             'is_shared': self.is_shared,
             'created_at': self.created_at.isoformat(),
-            'upvotes': upvotes,
-            'downvotes': downvotes
+            'updated_at': self.updated_at.isoformat(),
+            'upvotes': self.upvotes,
+            'downvotes': self.downvotes,
+            'score': self.score
         }
 
+@event.listens_for(Prompt, 'before_insert')
+@event.listens_for(Prompt, 'before_update')
+def _prompt_shared(mapper, connection, target):
+    # Ranks a newly shared prompt right away instead of at the next refresh
+    if target.is_shared and inspect(target).attrs.is_shared.history.has_changes():
+        target.hot_score = hot_score(target.score or 0, target.created_at)
+
+
+@event.listens_for(Prompt, 'after_insert')
+@event.listens_for(Prompt, 'after_delete')
+def _prompt_written(mapper, connection, target):
+    if target.is_shared:
+        CatalogueVersion.bump(inspect(target).session, connection)
+
+
+@event.listens_for(Prompt, 'after_update')
+def _prompt_updated(mapper, connection, target):
+    # Also called when only a collection such as generated_prompts changed
+    state = inspect(target)
+    if not state.session.is_modified(target, include_collections=False):
+        return
+    if target.is_shared or state.attrs.is_shared.history.has_changes():
+        CatalogueVersion.bump(state.session, connection)
+
+
+class CatalogueVersion(db.Model):
+    """Change counters of cached views, checked instead of re-running them.
+
+    The 'public' counter is bumped in the same transaction as any change to
+    a shared prompt, including its vote counts, so it versions the public
+    listing and search results.
+    """
+    PUBLIC = 'public'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def current(name=PUBLIC):
+        return db.session.query(CatalogueVersion.version).filter_by(name=name).scalar() or 0
+
+    @staticmethod
+    def bump(session, connection=None, name=PUBLIC):
+        """Bumps a counter in the session's transaction.
+
+        The session is flagged so that its commit can be announced to the
+        workers' caches (see catalogue_cache).
+        """
+        table = CatalogueVersion.__table__
+        connection = connection or session.connection()
+        connection.execute(table.update().where(table.c.name == name).values(version=table.c.version + 1))
+        session.info['catalogue_changed'] = True
+
+
+@event.listens_for(CatalogueVersion.__table__, 'after_create')
+def _create_catalogue_versions(target, connection, **kw):
+    connection.execute(target.insert().values(name=CatalogueVersion.PUBLIC, version=0))
+
+
 class PromptVote(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -58,49 +305,456 @@ class PromptVote(db.Model):
     __table_args__ = (db.UniqueConstraint('user_id', 'prompt_id', name='_user_prompt_uc'),)
 
 
+def serialize_prompts(query, *extra):
+    """Serializes a page of prompts in a single query.
+
+    The author is eager-loaded and vote counts come from the counter columns
+    on Prompt, so the number of queries does not depend on the number of
+    prompts or votes. `extra` names attributes to add to each dict, such as
+    a sort key that to_dict() leaves out.
+    """
+    return prompt_dicts(query.options(joinedload(Prompt.author)).all(), *extra)
+
+
+def prompt_dicts(prompts, *extra):
+    """Serializes loaded prompts, with the `extra` attributes of serialize_prompts."""
+    return [dict(prompt.to_dict(), **{name: getattr(prompt, name) for name in extra}) for prompt in prompts]
+
+
 class GeneratedPrompt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     prompt_id = db.Column(db.Integer, db.ForeignKey('prompt.id'), nullable=False)
-    generated_text = db.Column(db.Text, nullable=False)
-    
+    # The user who ran the generation and was charged for its tokens
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # The large columns are stored compressed, and moved to
+    # GeneratedPromptArchive (then NULL here) once the generation is archived
+    generated_text = db.Column(CompressedText)
+
     # Prompt analysis fields
     overall_score = db.Column(db.Integer)
     clarity = db.Column(db.Integer)
     specificity = db.Column(db.Integer)
     effectiveness = db.Column(db.Integer)
-    refined_prompt = db.Column(db.Text)
+    refined_prompt = db.Column(CompressedText)
     improvements_made = db.Column(db.JSON)
     additional_suggestions = db.Column(db.JSON)
 
     prompt_token_count = db.Column(db.Integer)
     candidates_token_count = db.Column(db.Integer)
+    # Served from the generation cache; no tokens were spent on it
+    from_cache = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false())
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    archived = db.Column(db.Boolean, default=False, nullable=False, server_default=db.false())
+    archive = db.relationship('GeneratedPromptArchive', uselist=False, lazy=True, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.Index('ix_generated_prompt_prompt_created_at', 'prompt_id', 'created_at', 'id'),
+    )
+
+    # Columns of the history listing; the generated text, refined prompt and
+    # suggestions are only loaded by the detail view
+    SUMMARY_COLUMNS = ('id', 'prompt_id', 'overall_score', 'clarity', 'specificity', 'effectiveness',
+                       'prompt_token_count', 'candidates_token_count', 'from_cache', 'created_at')
+
+    @staticmethod
+    def history_query(prompt_id):
+        """Generations of a prompt, loading only the summary columns."""
+        columns = [getattr(GeneratedPrompt, name) for name in GeneratedPrompt.SUMMARY_COLUMNS]
+        return GeneratedPrompt.query.filter_by(prompt_id=prompt_id).options(load_only(*columns))
+
+    @staticmethod
+    def history_version(prompt_id):
+        """Returns `(count, max id)` of a prompt's generations, from the index."""
+        return db.session.query(func.count(GeneratedPrompt.id), func.max(GeneratedPrompt.id)) \
+            .filter(GeneratedPrompt.prompt_id == prompt_id).one()
+
+    @staticmethod
+    def archive_before(cutoff, batch_size=500):
+        """Moves the large columns of generations created before `cutoff` to the archive.
+
+        Commits after each batch and returns the number of generations archived.
+        """
+        archived = 0
+        while True:
+            generations = GeneratedPrompt.query \
+                .filter(GeneratedPrompt.archived.is_(False), GeneratedPrompt.created_at < cutoff) \
+                .order_by(GeneratedPrompt.id) \
+                .limit(batch_size).all()
+            if not generations:
+                return archived
+            for generation in generations:
+                generation.archive = GeneratedPromptArchive(
+                    generated_text=generation.generated_text,
+                    refined_prompt=generation.refined_prompt,
+                    improvements_made=generation.improvements_made,
+                    additional_suggestions=generation.additional_suggestions,
+                )
+                generation.generated_text = generation.refined_prompt = None
+                generation.improvements_made = generation.additional_suggestions = None
+                generation.archived = True
+            db.session.commit()
+            archived += len(generations)
+
+    def to_summary_dict(self):
+        return {
+            'id': self.id,
+            'prompt_id': self.prompt_id,
+            'analysis': {
+                'overall_score': self.overall_score,
+                'clarity': self.clarity,
+                'specificity': self.specificity,
+                'effectiveness': self.effectiveness,
+            },
+            'usage_metadata': {
+                'prompt_token_count': self.prompt_token_count,
+                'candidates_token_count': self.candidates_token_count,
+            },
+            'cached': self.from_cache,
+            'created_at': self.created_at.isoformat()
+        }
 
     def to_dict(self):
+        content = self.archive if self.archived else self
         return {
             'id': self.id,
             'prompt_id': self.prompt_id,
-            'generated_text': self.generated_text,
+            'generated_text': content.generated_text,
             'analysis': {
                 'overall_score': self.overall_score,
                 'clarity': self.clarity,
                 'specificity': self.specificity,
                 'effectiveness': self.effectiveness,
-                'refined_prompt': self.refined_prompt,
-                'improvements_made': self.improvements_made,
-                'additional_suggestions': self.additional_suggestions,
+                'refined_prompt': content.refined_prompt,
+                'improvements_made': content.improvements_made,
+                'additional_suggestions': content.additional_suggestions,
             },
             'usage_metadata': {
                 'prompt_token_count': self.prompt_token_count,
                 'candidates_token_count': self.candidates_token_count,
             },
+            'cached': self.from_cache,
             'created_at': self.created_at.isoformat()
         }
 
+class GeneratedPromptArchive(db.Model):
+    """Large columns of archived generations, out of the generated_prompt table."""
+    generated_prompt_id = db.Column(db.Integer, db.ForeignKey('generated_prompt.id'), primary_key=True)
+    generated_text = db.Column(CompressedText)
+    refined_prompt = db.Column(CompressedText)
+    improvements_made = db.Column(db.JSON)
+    additional_suggestions = db.Column(db.JSON)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class GenerationStats:
+    """Running totals of the generations of a prompt or user.
+
+    Maintained by record() as each GeneratedPrompt is inserted, so reading
+    them never scans generated_prompt. Averages are over the generations
+    that were scored.
+    """
+    generations = db.Column(db.Integer, nullable=False, default=0)
+    scored_generations = db.Column(db.Integer, nullable=False, default=0)
+    overall_score_total = db.Column(db.Integer, nullable=False, default=0)
+    clarity_total = db.Column(db.Integer, nullable=False, default=0)
+    specificity_total = db.Column(db.Integer, nullable=False, default=0)
+    effectiveness_total = db.Column(db.Integer, nullable=False, default=0)
+    # overall_score_total / scored_generations, stored so it can be indexed
+    average_score = db.Column(db.Float)
+    best_score = db.Column(db.Integer)
+    prompt_token_count = db.Column(db.Integer, nullable=False, default=0)
+    candidates_token_count = db.Column(db.Integer, nullable=False, default=0)
+    last_generated_at = db.Column(db.DateTime)
+
+    # Column of GeneratedPrompt the totals are grouped by
+    KEY = None
+
+    @classmethod
+    def empty(cls, key):
+        """An unsaved row with no generations, for keys that have none yet."""
+        return cls(generations=0, scored_generations=0, overall_score_total=0, clarity_total=0,
+                   specificity_total=0, effectiveness_total=0, prompt_token_count=0,
+                   candidates_token_count=0, **{cls.KEY: key})
+
+    @classmethod
+    def rebuild(cls):
+        """Recomputes every row from generated_prompt, inside the current transaction."""
+        key = getattr(GeneratedPrompt, cls.KEY)
+        scored = GeneratedPrompt.overall_score.isnot(None)
+
+        def scored_total(column):
+            return func.coalesce(func.sum(case((scored, column), else_=None)), 0)
+        totals = db.select(
+            key,
+            func.count(GeneratedPrompt.id),
+            func.count(GeneratedPrompt.overall_score),
+            func.coalesce(func.sum(GeneratedPrompt.overall_score), 0),
+            scored_total(GeneratedPrompt.clarity),
+            scored_total(GeneratedPrompt.specificity),
+            scored_total(GeneratedPrompt.effectiveness),
+            func.avg(GeneratedPrompt.overall_score),
+            func.max(GeneratedPrompt.overall_score),
+            func.coalesce(func.sum(GeneratedPrompt.prompt_token_count), 0),
+            func.coalesce(func.sum(GeneratedPrompt.candidates_token_count), 0),
+            func.max(GeneratedPrompt.created_at),
+        ).where(key.isnot(None)).group_by(key)
+        table = cls.__table__
+        db.session.execute(table.delete())
+        db.session.execute(table.insert().from_select(
+            [cls.KEY, 'generations', 'scored_generations', 'overall_score_total', 'clarity_total',
+             'specificity_total', 'effectiveness_total', 'average_score', 'best_score',
+             'prompt_token_count', 'candidates_token_count', 'last_generated_at'],
+            totals,
+        ))
+
+    @classmethod
+    def record(cls, connection, key, generation):
+        """Adds one generation to the row of `key` (a dict of its primary key)."""
+        table = cls.__table__
+        scored = generation.overall_score is not None
+        created_at = generation.created_at or datetime.utcnow()
+        values = {
+            'generations': table.c.generations + 1,
+            'prompt_token_count': table.c.prompt_token_count + (generation.prompt_token_count or 0),
+            'candidates_token_count': table.c.candidates_token_count + (generation.candidates_token_count or 0),
+            'last_generated_at': created_at,
+        }
+        if scored:
+            score = generation.overall_score
+            values.update({
+                'scored_generations': table.c.scored_generations + 1,
+                'overall_score_total': table.c.overall_score_total + score,
+                'clarity_total': table.c.clarity_total + (generation.clarity or 0),
+                'specificity_total': table.c.specificity_total + (generation.specificity or 0),
+                'effectiveness_total': table.c.effectiveness_total + (generation.effectiveness or 0),
+                'average_score': (table.c.overall_score_total + score) * 1.0 / (table.c.scored_generations + 1),
+                'best_score': case((table.c.best_score.is_(None) | (table.c.best_score < score), score),
+                                   else_=table.c.best_score),
+            })
+        where = [table.c[name] == value for name, value in key.items()]
+        if connection.execute(table.update().where(*where).values(values)).rowcount:
+            return
+        try:
+            # First generation; a concurrent one may insert the row first
+            with connection.begin_nested():
+                connection.execute(table.insert().values(
+                    **key,
+                    generations=1,
+                    scored_generations=int(scored),
+                    overall_score_total=generation.overall_score or 0,
+                    clarity_total=(generation.clarity or 0) if scored else 0,
+                    specificity_total=(generation.specificity or 0) if scored else 0,
+                    effectiveness_total=(generation.effectiveness or 0) if scored else 0,
+                    average_score=generation.overall_score,
+                    best_score=generation.overall_score,
+                    prompt_token_count=generation.prompt_token_count or 0,
+                    candidates_token_count=generation.candidates_token_count or 0,
+                    last_generated_at=created_at,
+                ))
+        except IntegrityError:
+            connection.execute(table.update().where(*where).values(values))
+
+    def to_dict(self):
+        def average(total):
+            return total / self.scored_generations if self.scored_generations else None
+        return {
+            'generations': self.generations,
+            'scored_generations': self.scored_generations,
+            'average_score': self.average_score,
+            'average_clarity': average(self.clarity_total),
+            'average_specificity': average(self.specificity_total),
+            'average_effectiveness': average(self.effectiveness_total),
+            'best_score': self.best_score,
+            'prompt_token_count': self.prompt_token_count,
+            'candidates_token_count': self.candidates_token_count,
+            'last_generated_at': self.last_generated_at.isoformat() if self.last_generated_at else None,
+        }
+
+class PromptStats(GenerationStats, db.Model):
+    """Generation totals of a prompt; deleted with the prompt."""
+    prompt_id = db.Column(db.Integer, db.ForeignKey('prompt.id'), primary_key=True)
+    prompt = db.relationship('Prompt', back_populates='stats', lazy=True)
+    KEY = 'prompt_id'
+
+    __table_args__ = (
+        db.Index('ix_prompt_stats_average_score', 'average_score', 'prompt_id'),
+    )
+
+    def to_dict(self):
+        return {'prompt_id': self.prompt_id, **super().to_dict()}
+
+class UserStats(GenerationStats, db.Model):
+    """Totals of the generations a user ran, including those of since deleted prompts."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    KEY = 'user_id'
+
+    def to_dict(self):
+        return {'user_id': self.user_id, **super().to_dict()}
+
+
+@event.listens_for(GeneratedPrompt, 'after_insert')
+def _generation_inserted(mapper, connection, target):
+    PromptStats.record(connection, {'prompt_id': target.prompt_id}, target)
+    if target.user_id is not None:
+        UserStats.record(connection, {'user_id': target.user_id}, target)
+
+class GenerationJob(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    prompt_id = db.Column(db.Integer, db.ForeignKey('prompt.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    generated_prompt_id = db.Column(db.Integer, db.ForeignKey('generated_prompt.id'))
+    fresh = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())  # bypass the generation cache
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+    generated_prompt = db.relationship('GeneratedPrompt', lazy=True)
+
+    @property
+    def finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'prompt_id': self.prompt_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'result': self.generated_prompt.to_dict() if self.generated_prompt else None,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class GenerationCacheEntry(db.Model):
+    # sha256 of the model name and the fully rendered system prompt
+    key = db.Column(db.String(64), primary_key=True)
+    model = db.Column(db.String(64), nullable=False)
+    response = db.Column(db.JSON, nullable=False)
+    prompt_token_count = db.Column(db.Integer)
+    candidates_token_count = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_accessed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    hits = db.Column(db.Integer, nullable=False, default=0)
+
+    def usage(self):
+        return {
+            'prompt_token_count': self.prompt_token_count,
+            'candidates_token_count': self.candidates_token_count,
+        }
+
+class GenerationLock(db.Model):
+    # Held by the worker process making the model call for a cache key
+    key = db.Column(db.String(64), primary_key=True)
+    owner = db.Column(db.String(36), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+class UserTokenUsage(db.Model):
+    """Tokens charged to a user per UTC day, rolled up from GeneratedPrompt.
+
+    `reserved_token_count` holds the tokens of model calls in flight (see
+    tokens.TokenBudget.reserve), replaced by their actual usage once saved.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    prompt_token_count = db.Column(db.Integer, nullable=False, default=0)
+    candidates_token_count = db.Column(db.Integer, nullable=False, default=0)
+    generations = db.Column(db.Integer, nullable=False, default=0)
+    reserved_token_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @staticmethod
+    def record(user_id, usage, reservation=None, session=None):
+        """Adds the usage of one generation to today's row, inside the current transaction.
+
+        The `reservation` made for its model call, if any, is released in the
+        same transaction.
+        """
+        session = session or db.session
+        day = datetime.utcnow().date()
+        values = {
+            UserTokenUsage.prompt_token_count: UserTokenUsage.prompt_token_count + usage['prompt_token_count'],
+            UserTokenUsage.candidates_token_count: UserTokenUsage.candidates_token_count + usage['candidates_token_count'],
+            UserTokenUsage.generations: UserTokenUsage.generations + 1,
+        }
+        rollup = session.query(UserTokenUsage).filter_by(user_id=user_id, day=day)
+        if not rollup.update(values, synchronize_session=False):
+            try:
+                # First generation of the day; a concurrent one may insert the row first
+                with session.begin_nested():
+                    session.add(UserTokenUsage(
+                        user_id=user_id,
+                        day=day,
+                        prompt_token_count=usage['prompt_token_count'],
+                        candidates_token_count=usage['candidates_token_count'],
+                        generations=1,
+                    ))
+            except IntegrityError:
+                rollup.update(values, synchronize_session=False)
+        if reservation is not None:
+            UserTokenUsage.release(user_id, reservation, session=session)
+
+    @staticmethod
+    def reserve(user_id, day, tokens, quota, session=None):
+        """Holds `tokens` of the user's quota for `day` if they fit in it; returns whether they did."""
+        session = session or db.session
+        total = UserTokenUsage.prompt_token_count + UserTokenUsage.candidates_token_count \
+            + UserTokenUsage.reserved_token_count
+        rollup = session.query(UserTokenUsage).filter_by(user_id=user_id, day=day)
+        values = {UserTokenUsage.reserved_token_count: UserTokenUsage.reserved_token_count + tokens}
+        # A single conditional update, so concurrent reservations cannot both fit
+        if rollup.filter(total + tokens <= quota).update(values, synchronize_session=False):
+            return True
+        if tokens > quota or session.query(rollup.exists()).scalar():
+            return False
+        try:
+            with session.begin_nested():
+                session.add(UserTokenUsage(user_id=user_id, day=day, prompt_token_count=0,
+                                           candidates_token_count=0, generations=0, reserved_token_count=tokens))
+            return True
+        except IntegrityError:
+            return bool(rollup.filter(total + tokens <= quota).update(values, synchronize_session=False))
+
+    @staticmethod
+    def release(user_id, reservation, session=None):
+        """Gives back the `(day, tokens)` held by reserve()."""
+        session = session or db.session
+        day, tokens = reservation
+        session.query(UserTokenUsage).filter_by(user_id=user_id, day=day).update(
+            {UserTokenUsage.reserved_token_count: UserTokenUsage.reserved_token_count - tokens},
+            synchronize_session=False)
+
+    @staticmethod
+    def used_on(user_id, day, session=None):
+        """Tokens charged or reserved on `day`."""
+        session = session or db.session
+        row = session.get(UserTokenUsage, (user_id, day), populate_existing=True)
+        return row.prompt_token_count + row.candidates_token_count + row.reserved_token_count if row else 0
+
 class TokenBlacklist(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     jti = db.Column(db.String(36), nullable=False, unique=True)
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # When the revoked token would have expired; the row is useless after that
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    @staticmethod
+    def purge_expired(batch_size=1000):
+        """Deletes expired rows in batches, committing after each batch.
+
+        Returns the number of rows deleted.
+        """
+        deleted = 0
+        while True:
+            ids = [row_id for (row_id,) in db.session.query(TokenBlacklist.id)
+                   .filter(TokenBlacklist.expires_at <= datetime.utcnow())
+                   .order_by(TokenBlacklist.expires_at)
+                   .limit(batch_size)]
+            if not ids:
+                return deleted
+            TokenBlacklist.query.filter(TokenBlacklist.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            deleted += len(ids)
 
     def __repr__(self):
         return f"<TokenBlacklist {self.jti}>"
@@ -0,0 +1,129 @@
+import hashlib
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import bindparam
+from sqlalchemy.exc import OperationalError
+from cache import TTLCache
+from database import db, GenerationCacheEntry
+from logger import logger
+
+
+def cache_key(system_prompt, model_name):
+    """Content address of a generation: the rendered prompt plus the model."""
+    return hashlib.sha256(f"{model_name}\0{system_prompt}".encode()).hexdigest()
+
+
+class GenerationCache:
+    """Two-tier cache of parsed model responses.
+
+    Entries are stored in the GenerationCacheEntry table so every worker
+    shares them, fronted by a small in-process TTL cache. Entries expire
+    `ttl` seconds after they were generated, and the table is trimmed to the
+    `max_entries` most recently used rows.
+
+    Lookups never write: hits are counted in memory and written to the
+    table in one batch every `hit_flush_interval` seconds, so access times
+    are as coarse as that interval.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.ttl = config['GENERATION_CACHE_TTL']
+        self.max_entries = config['GENERATION_CACHE_MAX_ENTRIES']
+        self.evict_every = config['GENERATION_CACHE_EVICT_EVERY']
+        self.hit_flush_interval = config['GENERATION_CACHE_HIT_FLUSH_INTERVAL']
+        self.memory = TTLCache(maxsize=config['GENERATION_CACHE_MEMORY_SIZE'], ttl=min(self.ttl, 300))
+        self._puts = 0
+        self._hits = {}
+        self._hits_lock = threading.Lock()
+        self._hits_flushed_at = time.monotonic()
+
+    def get(self, key):
+        """Returns `(data, usage)` for a cached generation, or None."""
+        entry = self.memory.get(key)
+        if entry is None:
+            row = db.session.get(GenerationCacheEntry, key)
+            # An expired row is overwritten by the fresh response, or dropped by evict()
+            if row is None or row.created_at < datetime.utcnow() - timedelta(seconds=self.ttl):
+                return None
+            entry = (row.response, row.usage())
+            self.memory.set(key, entry)
+        self.record_hit(key)
+        return entry
+
+    def record_hit(self, key):
+        with self._hits_lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            due = time.monotonic() - self._hits_flushed_at >= self.hit_flush_interval
+        if due:
+            self.flush_hits()
+
+    def flush_hits(self):
+        """Writes the counted hits in one transaction of its own.
+
+        Runs on a separate connection, so the caller's session is left alone.
+        """
+        with self._hits_lock:
+            hits, self._hits = self._hits, {}
+            self._hits_flushed_at = time.monotonic()
+        if not hits:
+            return
+        table = GenerationCacheEntry.__table__
+        statement = table.update().where(table.c.key == bindparam('entry_key')) \
+            .values(hits=table.c.hits + bindparam('count'), last_accessed_at=datetime.utcnow())
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(statement, [{'entry_key': key, 'count': count} for key, count in hits.items()])
+        except OperationalError as e:
+            # Keep the counts for the next flush rather than fail the lookup
+            logger.warning(f"Could not record {len(hits)} generation cache hits: {e}")
+            with self._hits_lock:
+                for key, count in hits.items():
+                    self._hits[key] = self._hits.get(key, 0) + count
+
+    def put(self, key, model_name, data, usage):
+        now = datetime.utcnow()
+        db.session.merge(GenerationCacheEntry(
+            key=key,
+            model=model_name,
+            response=data,
+            prompt_token_count=usage['prompt_token_count'],
+            candidates_token_count=usage['candidates_token_count'],
+            created_at=now,
+            last_accessed_at=now,
+            hits=0,
+        ))
+        db.session.commit()
+        self.memory.set(key, (data, usage))
+
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self):
+        """Drops expired entries and the least recently used ones over the limit."""
+        self.flush_hits()
+        expired_before = datetime.utcnow() - timedelta(seconds=self.ttl)
+        expired = GenerationCacheEntry.query.filter(GenerationCacheEntry.created_at < expired_before) \
+            .delete(synchronize_session=False)
+
+        overflow = 0
+        cutoff = db.session.query(GenerationCacheEntry.last_accessed_at) \
+            .order_by(GenerationCacheEntry.last_accessed_at.desc()) \
+            .offset(self.max_entries).limit(1).scalar()
+        if cutoff is not None:
+            overflow = GenerationCacheEntry.query.filter(GenerationCacheEntry.last_accessed_at <= cutoff) \
+                .delete(synchronize_session=False)
+        db.session.commit()
+        if expired or overflow:
+            logger.info(f"Evicted {expired} expired and {overflow} least recently used cached generations.")
+
+
+def init_app(app):
+    app.extensions['generation_cache'] = GenerationCache(app)
+
+
+def get_generation_cache():
+    return current_app.extensions['generation_cache']
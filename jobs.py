@@ -0,0 +1,120 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from database import db, Prompt, GenerationJob
+from services import GenerationError, generate_for_prompt
+from logger import logger
+
+
+class QueueFull(Exception):
+    """Raised when too many generation jobs are already waiting."""
+
+
+class JobQueue:
+    """Runs generation jobs on a bounded pool of worker threads.
+
+    Job state lives in the GenerationJob table so any worker process can
+    report on it; waiters in the process that runs a job are woken through
+    an in-memory event instead of polling. Jobs that are still queued when
+    their process exits are not resumed.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.max_retries = app.config['GENERATION_MAX_RETRIES']
+        self.retry_backoff = app.config['GENERATION_RETRY_BACKOFF']
+        self._executor = ThreadPoolExecutor(
+            max_workers=app.config['GENERATION_WORKERS'], thread_name_prefix='generation'
+        )
+        # Bounds queued plus running jobs, so overload is rejected up front
+        self._slots = threading.BoundedSemaphore(app.config['GENERATION_QUEUE_SIZE'])
+        self._events = {}
+        self._lock = threading.Lock()
+
+    def submit(self, prompt, user, fresh=False):
+        """Creates a job for `prompt` and schedules it."""
+        if not self._slots.acquire(blocking=False):
+            raise QueueFull()
+        job = GenerationJob(id=str(uuid.uuid4()), prompt_id=prompt.id, user_id=user.id, fresh=fresh)
+        try:
+            db.session.add(job)
+            db.session.commit()
+        except Exception:
+            # No job will run to release the slot
+            db.session.rollback()
+            self._slots.release()
+            raise
+        with self._lock:
+            self._events[job.id] = threading.Event()
+        self._executor.submit(self._run, job.id)
+        logger.info(f"Queued generation job {job.id} for prompt {prompt.id}.")
+        return job
+
+    def _run(self, job_id):
+        try:
+            with self.app.app_context():
+                self._execute(job_id)
+        finally:
+            self._slots.release()
+            with self._lock:
+                event = self._events.pop(job_id, None)
+            if event:
+                event.set()
+
+    def _execute(self, job_id):
+        job = db.session.get(GenerationJob, job_id)
+        prompt = db.session.get(Prompt, job.prompt_id)
+        db.session.info['user_id'] = job.user_id
+        while True:
+            job.status = 'running'
+            job.attempts += 1
+            db.session.commit()
+            try:
+                if prompt is None:
+                    raise GenerationError("Prompt no longer exists.", retryable=False)
+                generated_prompt = generate_for_prompt(prompt, fresh=job.fresh, user_id=job.user_id)
+                job.status = 'succeeded'
+                job.generated_prompt_id = generated_prompt.id
+                job.error = None
+                db.session.commit()
+                return
+            except Exception as e:
+                db.session.rollback()
+                retryable = getattr(e, 'retryable', True)
+                logger.error(f"Generation job {job_id} attempt {job.attempts} failed: {e}")
+                if not retryable or job.attempts > self.max_retries:
+                    job.status = 'failed'
+                    job.error = str(e)
+                    db.session.commit()
+                    return
+                time.sleep(self.retry_backoff * 2 ** (job.attempts - 1))
+
+    def local_event(self, job_id):
+        """Returns the completion event of a job run by this process, if any."""
+        with self._lock:
+            return self._events.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """Blocks until the job finishes or `timeout` seconds have passed."""
+        event = self.local_event(job_id)
+        if event is not None:
+            event.wait(timeout)
+            return
+        # The job runs in another process, poll its row instead
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            status = db.session.query(GenerationJob.status).filter_by(id=job_id).scalar()
+            if status in ('succeeded', 'failed', None):
+                return
+            db.session.rollback()
+            time.sleep(0.25)
+
+
+def init_app(app):
+    app.extensions['job_queue'] = JobQueue(app)
+
+
+def get_job_queue():
+    return current_app.extensions['job_queue']
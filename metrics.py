@@ -0,0 +1,35 @@
+import threading
+from collections import Counter
+
+
+class Metrics:
+    """Process-local counters, exported in the Prometheus text format.
+
+    Each worker process keeps its own counts; a scraper sums them per
+    instance.
+    """
+
+    def __init__(self):
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += amount
+
+    def value(self, name, **labels):
+        with self._lock:
+            return self._counters[(name, tuple(sorted(labels.items())))]
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+        lines = []
+        for (name, labels), value in counters:
+            label_text = ','.join(f'{key}="{value}"' for key, value in labels)
+            lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return ''.join(f'{line}\n' for line in lines)
+
+
+metrics = Metrics()
@@ -0,0 +1,51 @@
+"""Add generation cache
+
+Revision ID: 1b5d7e9f3c68
+Revises: 0a7e93c5b2d4
+Create Date: 2026-10-17 16:44:02.915736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b5d7e9f3c68'
+down_revision = '0a7e93c5b2d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('generation_cache_entry',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('model', sa.String(length=64), nullable=False),
+    sa.Column('response', sa.JSON(), nullable=False),
+    sa.Column('prompt_token_count', sa.Integer(), nullable=True),
+    sa.Column('candidates_token_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_accessed_at', sa.DateTime(), nullable=False),
+    sa.Column('hits', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('generation_cache_entry', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_generation_cache_entry_last_accessed_at'), ['last_accessed_at'], unique=False)
+
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('from_cache', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    with op.batch_alter_table('generation_job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('fresh', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade():
+    with op.batch_alter_table('generation_job', schema=None) as batch_op:
+        batch_op.drop_column('fresh')
+
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_column('from_cache')
+
+    with op.batch_alter_table('generation_cache_entry', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_generation_cache_entry_last_accessed_at'))
+
+    op.drop_table('generation_cache_entry')
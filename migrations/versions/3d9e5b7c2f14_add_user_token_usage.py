@@ -0,0 +1,77 @@
+"""Add GeneratedPrompt.user_id and UserTokenUsage table
+
+Revision ID: 3d9e5b7c2f14
+Revises: 2c8f4a6d1e97
+Create Date: 2026-10-17 19:12:08.463915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3d9e5b7c2f14'
+down_revision = '2c8f4a6d1e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_generated_prompt_user_id_user', 'user', ['user_id'], ['id'])
+
+    # Who ran past generations was not recorded; charge them to the prompt's owner
+    op.execute(
+        "UPDATE generated_prompt SET user_id = "
+        "(SELECT prompt.user_id FROM prompt WHERE prompt.id = generated_prompt.prompt_id)"
+    )
+
+    op.create_table('user_token_usage',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('prompt_token_count', sa.Integer(), nullable=False),
+    sa.Column('candidates_token_count', sa.Integer(), nullable=False),
+    sa.Column('generations', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+
+    generated_prompt = sa.table(
+        'generated_prompt',
+        sa.column('user_id', sa.Integer),
+        sa.column('created_at', sa.DateTime),
+        sa.column('prompt_token_count', sa.Integer),
+        sa.column('candidates_token_count', sa.Integer),
+        sa.column('from_cache', sa.Boolean),
+    )
+    user_token_usage = sa.table(
+        'user_token_usage',
+        sa.column('user_id'),
+        sa.column('day'),
+        sa.column('prompt_token_count'),
+        sa.column('candidates_token_count'),
+        sa.column('generations'),
+    )
+    day = sa.func.date(generated_prompt.c.created_at)
+    rollup = sa.select(
+        generated_prompt.c.user_id,
+        day,
+        sa.func.coalesce(sa.func.sum(generated_prompt.c.prompt_token_count), 0),
+        sa.func.coalesce(sa.func.sum(generated_prompt.c.candidates_token_count), 0),
+        sa.func.count(),
+    ).where(
+        generated_prompt.c.from_cache.is_(False),
+        generated_prompt.c.user_id.isnot(None),
+        generated_prompt.c.created_at.isnot(None),
+    ).group_by(generated_prompt.c.user_id, day)
+    op.execute(user_token_usage.insert().from_select(
+        ['user_id', 'day', 'prompt_token_count', 'candidates_token_count', 'generations'], rollup
+    ))
+
+
+def downgrade():
+    op.drop_table('user_token_usage')
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_constraint('fk_generated_prompt_user_id_user', type_='foreignkey')
+        batch_op.drop_column('user_id')
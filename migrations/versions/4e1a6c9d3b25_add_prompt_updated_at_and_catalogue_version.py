@@ -0,0 +1,46 @@
+"""Add Prompt.updated_at, CatalogueVersion table and generation history index
+
+Revision ID: 4e1a6c9d3b25
+Revises: 3d9e5b7c2f14
+Create Date: 2026-10-17 21:36:42.180337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e1a6c9d3b25'
+down_revision = '3d9e5b7c2f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    op.execute("UPDATE prompt SET updated_at = created_at")
+
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+    catalogue_version = op.create_table('catalogue_version',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(catalogue_version, [{'name': 'public', 'version': 0}])
+
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.create_index('ix_generated_prompt_prompt_id', ['prompt_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_generated_prompt_prompt_id')
+
+    op.drop_table('catalogue_version')
+
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,28 @@
+"""Index GeneratedPrompt history by prompt_id and created_at
+
+Revision ID: 5f2b8d0e4c36
+Revises: 4e1a6c9d3b25
+Create Date: 2026-10-17 22:48:15.602714
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2b8d0e4c36'
+down_revision = '4e1a6c9d3b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_generated_prompt_prompt_id')
+        batch_op.create_index('ix_generated_prompt_prompt_created_at', ['prompt_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_generated_prompt_prompt_created_at')
+        batch_op.create_index('ix_generated_prompt_prompt_id', ['prompt_id', 'id'], unique=False)
@@ -0,0 +1,95 @@
+"""Compress GeneratedPrompt text columns and add GeneratedPromptArchive table
+
+Revision ID: 6a3c9e1f5d47
+Revises: 5f2b8d0e4c36
+Create Date: 2026-10-17 23:54:31.027488
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from compression import compress_text, decompress_text
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3c9e1f5d47'
+down_revision = '5f2b8d0e4c36'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+generated_prompt = sa.table(
+    'generated_prompt',
+    sa.column('id', sa.Integer),
+    sa.column('generated_text'),
+    sa.column('refined_prompt'),
+)
+
+
+def recode(convert):
+    """Rewrites the text columns of every row with `convert`, in batches by id."""
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(generated_prompt.c.id, generated_prompt.c.generated_text, generated_prompt.c.refined_prompt)
+            .where(generated_prompt.c.id > last_id)
+            .order_by(generated_prompt.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        connection.execute(
+            generated_prompt.update().where(generated_prompt.c.id == sa.bindparam('row_id')),
+            [{'row_id': row_id, 'generated_text': convert(text), 'refined_prompt': convert(refined)}
+             for row_id, text, refined in rows],
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.alter_column('generated_text', existing_type=sa.Text(), type_=sa.LargeBinary(), nullable=True,
+                              postgresql_using="convert_to(generated_text, 'UTF8')")
+        batch_op.alter_column('refined_prompt', existing_type=sa.Text(), type_=sa.LargeBinary(),
+                              postgresql_using="convert_to(refined_prompt, 'UTF8')")
+        batch_op.add_column(sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+    recode(lambda value: compress_text(decompress_text(value)))
+
+    op.create_table('generated_prompt_archive',
+    sa.Column('generated_prompt_id', sa.Integer(), nullable=False),
+    sa.Column('generated_text', sa.LargeBinary(), nullable=True),
+    sa.Column('refined_prompt', sa.LargeBinary(), nullable=True),
+    sa.Column('improvements_made', sa.JSON(), nullable=True),
+    sa.Column('additional_suggestions', sa.JSON(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['generated_prompt_id'], ['generated_prompt.id'], ),
+    sa.PrimaryKeyConstraint('generated_prompt_id')
+    )
+
+
+def downgrade():
+    # Bring archived content back before dropping the archive
+    op.execute(
+        "UPDATE generated_prompt SET "
+        "generated_text = (SELECT a.generated_text FROM generated_prompt_archive a WHERE a.generated_prompt_id = generated_prompt.id), "
+        "refined_prompt = (SELECT a.refined_prompt FROM generated_prompt_archive a WHERE a.generated_prompt_id = generated_prompt.id), "
+        "improvements_made = (SELECT a.improvements_made FROM generated_prompt_archive a WHERE a.generated_prompt_id = generated_prompt.id), "
+        "additional_suggestions = (SELECT a.additional_suggestions FROM generated_prompt_archive a WHERE a.generated_prompt_id = generated_prompt.id) "
+        "WHERE archived"
+    )
+    op.drop_table('generated_prompt_archive')
+
+    # SQLite keeps the declared TEXT affinity only for values bound as str
+    as_bytes = op.get_bind().dialect.name != 'sqlite'
+    recode(lambda value: decompress_text(value).encode('utf-8')
+           if as_bytes and value is not None else decompress_text(value))
+
+    with op.batch_alter_table('generated_prompt', schema=None) as batch_op:
+        batch_op.drop_column('archived')
+        batch_op.alter_column('refined_prompt', existing_type=sa.LargeBinary(), type_=sa.Text(),
+                              postgresql_using="convert_from(refined_prompt, 'UTF8')")
+        batch_op.alter_column('generated_text', existing_type=sa.LargeBinary(), type_=sa.Text(), nullable=False,
+                              postgresql_using="convert_from(generated_text, 'UTF8')")
@@ -0,0 +1,75 @@
+"""Add PromptStats and UserStats generation rollups
+
+Revision ID: 7b4d0f2a6e58
+Revises: 6a3c9e1f5d47
+Create Date: 2026-10-17 23:41:27.318406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b4d0f2a6e58'
+down_revision = '6a3c9e1f5d47'
+branch_labels = None
+depends_on = None
+
+
+def stats_columns():
+    return [
+        sa.Column('generations', sa.Integer(), nullable=False),
+        sa.Column('scored_generations', sa.Integer(), nullable=False),
+        sa.Column('overall_score_total', sa.Integer(), nullable=False),
+        sa.Column('clarity_total', sa.Integer(), nullable=False),
+        sa.Column('specificity_total', sa.Integer(), nullable=False),
+        sa.Column('effectiveness_total', sa.Integer(), nullable=False),
+        sa.Column('average_score', sa.Float(), nullable=True),
+        sa.Column('best_score', sa.Integer(), nullable=True),
+        sa.Column('prompt_token_count', sa.Integer(), nullable=False),
+        sa.Column('candidates_token_count', sa.Integer(), nullable=False),
+        sa.Column('last_generated_at', sa.DateTime(), nullable=True),
+    ]
+
+
+def backfill(table, key):
+    op.execute(
+        f"INSERT INTO {table} ({key}, generations, scored_generations, overall_score_total, clarity_total, "
+        "specificity_total, effectiveness_total, average_score, best_score, prompt_token_count, "
+        "candidates_token_count, last_generated_at) "
+        f"SELECT {key}, count(id), count(overall_score), coalesce(sum(overall_score), 0), "
+        "coalesce(sum(CASE WHEN overall_score IS NOT NULL THEN clarity END), 0), "
+        "coalesce(sum(CASE WHEN overall_score IS NOT NULL THEN specificity END), 0), "
+        "coalesce(sum(CASE WHEN overall_score IS NOT NULL THEN effectiveness END), 0), "
+        "avg(overall_score), max(overall_score), coalesce(sum(prompt_token_count), 0), "
+        "coalesce(sum(candidates_token_count), 0), max(created_at) "
+        f"FROM generated_prompt WHERE {key} IS NOT NULL GROUP BY {key}"
+    )
+
+
+def upgrade():
+    op.create_table('prompt_stats',
+    sa.Column('prompt_id', sa.Integer(), nullable=False),
+    *stats_columns(),
+    sa.ForeignKeyConstraint(['prompt_id'], ['prompt.id'], ),
+    sa.PrimaryKeyConstraint('prompt_id')
+    )
+    with op.batch_alter_table('prompt_stats', schema=None) as batch_op:
+        batch_op.create_index('ix_prompt_stats_average_score', ['average_score', 'prompt_id'], unique=False)
+
+    op.create_table('user_stats',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    *stats_columns(),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+
+    backfill('prompt_stats', 'prompt_id')
+    backfill('user_stats', 'user_id')
+
+
+def downgrade():
+    op.drop_table('user_stats')
+    with op.batch_alter_table('prompt_stats', schema=None) as batch_op:
+        batch_op.drop_index('ix_prompt_stats_average_score')
+    op.drop_table('prompt_stats')
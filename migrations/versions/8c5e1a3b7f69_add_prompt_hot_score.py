@@ -0,0 +1,49 @@
+"""Add Prompt.hot_score and its index
+
+Revision ID: 8c5e1a3b7f69
+Revises: 7b4d0f2a6e58
+Create Date: 2026-10-18 00:27:52.904133
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c5e1a3b7f69'
+down_revision = '7b4d0f2a6e58'
+branch_labels = None
+depends_on = None
+
+# database.HOT_GRAVITY when this migration was written
+HOT_GRAVITY = 1.8
+
+
+def upgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hot_score', sa.Float(), server_default='0', nullable=False))
+        batch_op.create_index('ix_prompt_is_shared_hot_score', ['is_shared', 'hot_score', 'id'], unique=False)
+
+    connection = op.get_bind()
+    prompt = sa.table('prompt', sa.column('id', sa.Integer), sa.column('score', sa.Integer),
+                      sa.column('created_at', sa.DateTime), sa.column('is_shared', sa.Boolean),
+                      sa.column('hot_score', sa.Float))
+    now = datetime.utcnow()
+    rows = connection.execute(
+        sa.select(prompt.c.id, prompt.c.score, prompt.c.created_at).where(prompt.c.is_shared == sa.true())
+    ).all()
+    if rows:
+        connection.execute(
+            prompt.update().where(prompt.c.id == sa.bindparam('prompt_id')).values(hot_score=sa.bindparam('hot')),
+            [{'prompt_id': row.id,
+              'hot': (row.score + 1) / (max((now - row.created_at).total_seconds() / 3600, 0) + 2) ** HOT_GRAVITY}
+             for row in rows],
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_prompt_is_shared_hot_score')
+        batch_op.drop_column('hot_score')
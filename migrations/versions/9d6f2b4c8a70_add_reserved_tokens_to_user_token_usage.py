@@ -0,0 +1,26 @@
+"""Add UserTokenUsage.reserved_token_count
+
+Revision ID: 9d6f2b4c8a70
+Revises: 8c5e1a3b7f69
+Create Date: 2026-10-18 09:12:40.318527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d6f2b4c8a70'
+down_revision = '8c5e1a3b7f69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_token_usage', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reserved_token_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('user_token_usage', schema=None) as batch_op:
+        batch_op.drop_column('reserved_token_count')
@@ -0,0 +1,40 @@
+"""Add vote counters to Prompt
+
+Revision ID: b7d2e4f1a9c3
+Revises: 1ea33adf0ee9
+Create Date: 2026-10-17 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d2e4f1a9c3'
+down_revision = '1ea33adf0ee9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('upvotes', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('downvotes', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('score', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.create_index('ix_prompt_is_shared_score', ['is_shared', 'score'], unique=False)
+
+    # Backfill the counters from the existing votes
+    op.execute("""
+        UPDATE prompt SET
+            upvotes = (SELECT COUNT(*) FROM prompt_vote WHERE prompt_vote.prompt_id = prompt.id AND prompt_vote.vote = 1),
+            downvotes = (SELECT COUNT(*) FROM prompt_vote WHERE prompt_vote.prompt_id = prompt.id AND prompt_vote.vote = -1)
+    """)
+    op.execute("UPDATE prompt SET score = upvotes - downvotes")
+
+
+def downgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_prompt_is_shared_score')
+        batch_op.drop_column('score')
+        batch_op.drop_column('downvotes')
+        batch_op.drop_column('upvotes')
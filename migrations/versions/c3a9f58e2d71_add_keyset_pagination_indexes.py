@@ -0,0 +1,32 @@
+"""Add keyset pagination indexes to Prompt
+
+Revision ID: c3a9f58e2d71
+Revises: b7d2e4f1a9c3
+Create Date: 2026-10-17 10:03:27.554910
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a9f58e2d71'
+down_revision = 'b7d2e4f1a9c3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_prompt_is_shared_score')
+        batch_op.create_index('ix_prompt_is_shared_score', ['is_shared', 'score', 'id'], unique=False)
+        batch_op.create_index('ix_prompt_is_shared_created_at', ['is_shared', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_prompt_user_created_at', ['user_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('prompt', schema=None) as batch_op:
+        batch_op.drop_index('ix_prompt_user_created_at')
+        batch_op.drop_index('ix_prompt_is_shared_created_at')
+        batch_op.drop_index('ix_prompt_is_shared_score')
+        batch_op.create_index('ix_prompt_is_shared_score', ['is_shared', 'score'], unique=False)
@@ -0,0 +1,45 @@
+"""Add full-text search index for shared prompts
+
+Revision ID: d84be1c07f52
+Revises: c3a9f58e2d71
+Create Date: 2026-10-17 11:26:09.742315
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd84be1c07f52'
+down_revision = 'c3a9f58e2d71'
+branch_labels = None
+depends_on = None
+
+SEARCH_FIELDS = 'title, text, tags, intended_use, target_audience, expected_outcome'
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute(f"CREATE VIRTUAL TABLE prompt_fts USING fts5({SEARCH_FIELDS}, tokenize = 'porter unicode61')")
+        op.execute("INSERT INTO prompt_fts(prompt_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 5.0, 2.0, 2.0, 1.0)')")
+        op.execute(f"INSERT INTO prompt_fts(rowid, {SEARCH_FIELDS}) SELECT id, {SEARCH_FIELDS} FROM prompt WHERE is_shared")
+    elif dialect == 'postgresql':
+        op.execute("""
+            CREATE INDEX ix_prompt_search_vector ON prompt USING gin ((
+                setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(tags, '')), 'B') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(intended_use, '')), 'C') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(target_audience, '')), 'C') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(expected_outcome, '')), 'C') ||
+                setweight(to_tsvector('english'::regconfig, coalesce(text, '')), 'D')
+            ))
+        """)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        op.execute("DROP TABLE prompt_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX ix_prompt_search_vector")
@@ -0,0 +1,64 @@
+"""Add Tag and prompt_tag tables
+
+Revision ID: e5f07c3b9a12
+Revises: d84be1c07f52
+Create Date: 2026-10-17 12:48:55.106532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5f07c3b9a12'
+down_revision = 'd84be1c07f52'
+branch_labels = None
+depends_on = None
+
+
+def parse_tags(raw):
+    names = []
+    for name in (raw or '').split(','):
+        name = name.strip().lower()[:50]
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def upgrade():
+    tag = op.create_table('tag',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    prompt_tag = op.create_table('prompt_tag',
+    sa.Column('prompt_id', sa.Integer(), nullable=False),
+    sa.Column('tag_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['prompt_id'], ['prompt.id'], ),
+    sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+    sa.PrimaryKeyConstraint('prompt_id', 'tag_id')
+    )
+    op.create_index('ix_prompt_tag_tag_id', 'prompt_tag', ['tag_id', 'prompt_id'], unique=False)
+
+    # Parse the existing comma-separated tag strings into the new tables
+    connection = op.get_bind()
+    rows = connection.execute(sa.text("SELECT id, tags FROM prompt WHERE tags IS NOT NULL AND tags != ''"))
+    tag_ids = {}
+    links = []
+    for prompt_id, raw in rows:
+        for name in parse_tags(raw):
+            if name not in tag_ids:
+                tag_ids[name] = len(tag_ids) + 1
+            links.append({'prompt_id': prompt_id, 'tag_id': tag_ids[name]})
+    if tag_ids:
+        op.bulk_insert(tag, [{'id': tag_id, 'name': name} for name, tag_id in tag_ids.items()])
+        op.bulk_insert(prompt_tag, links)
+        if connection.dialect.name == 'postgresql':
+            op.execute("SELECT setval(pg_get_serial_sequence('tag', 'id'), (SELECT MAX(id) FROM tag))")
+
+
+def downgrade():
+    op.drop_index('ix_prompt_tag_tag_id', table_name='prompt_tag')
+    op.drop_table('prompt_tag')
+    op.drop_table('tag')
@@ -0,0 +1,38 @@
+"""Add expires_at to TokenBlacklist
+
+Revision ID: f1c6a2d8e430
+Revises: e5f07c3b9a12
+Create Date: 2026-10-17 14:05:32.871460
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c6a2d8e430'
+down_revision = 'e5f07c3b9a12'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('token_blacklist', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+
+    # Tokens are issued for 24 hours and are revoked some time after issue, so
+    # created_at + 24h is a safe upper bound for the existing rows
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("UPDATE token_blacklist SET expires_at = datetime(created_at, '+1 day')")
+    else:
+        op.execute("UPDATE token_blacklist SET expires_at = created_at + interval '1 day'")
+
+    with op.batch_alter_table('token_blacklist', schema=None) as batch_op:
+        batch_op.alter_column('expires_at', existing_type=sa.DateTime(), nullable=False)
+        batch_op.create_index(batch_op.f('ix_token_blacklist_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('token_blacklist', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_token_blacklist_expires_at'))
+        batch_op.drop_column('expires_at')
@@ -0,0 +1,103 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_, DateTime
+
+
+class PaginationError(ValueError):
+    """Raised when the limit or cursor of a request is invalid."""
+
+
+def encode_cursor(values):
+    """Encodes the sort key values of the last row into an opaque cursor."""
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """Decodes a cursor back into values typed like the sort key columns."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        raise PaginationError('Invalid cursor.')
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise PaginationError('Invalid cursor.')
+
+    decoded = []
+    for (column, _), value in zip(keys, values):
+        if isinstance(column.type, DateTime) and value is not None:
+            try:
+                value = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                raise PaginationError('Invalid cursor.')
+        decoded.append(value)
+    return decoded
+
+
+def keyset_filter(keys, values):
+    """Builds the keyset predicate selecting rows strictly after `values`.
+
+    Expanded into OR/AND terms instead of a row-value comparison so that
+    mixed sort directions and every backend are supported.
+    """
+    clauses = []
+    for i, (column, descending) in enumerate(keys):
+        beyond = column < values[i] if descending else column > values[i]
+        equal = [keys[j][0] == values[j] for j in range(i)]
+        clauses.append(and_(*equal, beyond))
+    return or_(*clauses)
+
+
+def parse_limit(value, default, maximum):
+    """Parses a requested page size, bounded by `maximum`."""
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError('Invalid limit.')
+    if limit < 1:
+        raise PaginationError('Invalid limit.')
+    return min(limit, maximum)
+
+
+def page_limit():
+    """Reads the `limit` query parameter, bounded by the configured maximum."""
+    return parse_limit(request.args.get('limit'), current_app.config['PAGE_SIZE'], current_app.config['MAX_PAGE_SIZE'])
+
+
+def keyset_page(query, keys, cursor, limit):
+    """Limits a query or select to the page after `cursor`.
+
+    One row more than `limit` is fetched, telling page_result() whether
+    there is a next page.
+    """
+    if cursor:
+        query = query.filter(keyset_filter(keys, decode_cursor(cursor, keys)))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+    return query.limit(limit + 1)
+
+
+def page_result(items, keys, limit):
+    """Returns `(items, next_cursor)` from the serialized rows of keyset_page()."""
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor([items[-1][column.key] for column, _ in keys])
+    return items, next_cursor
+
+
+def paginate(query, keys, serialize):
+    """Returns one page of `query` using keyset pagination.
+
+    `keys` is a list of `(column, descending)` pairs, the last of which must be
+    unique (usually the primary key). `serialize` turns the limited query into
+    a list of dicts that contain each key column by name; the values of the
+    last dict become the `next_cursor`. Returns `(items, next_cursor)`.
+    """
+    limit = page_limit()
+    items = serialize(keyset_page(query, keys, request.args.get('cursor'), limit))
+    return page_result(items, keys, limit)
@@ -0,0 +1,214 @@
+import json
+import math
+import re
+
+_ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+
+class StringFieldStreamer:
+    """Incrementally decodes one string field of a JSON object being streamed.
+
+    Feed it the raw text chunks as they arrive; each call returns the newly
+    decoded part of the field's value, so it can be forwarded before the
+    rest of the object is complete.
+    """
+
+    def __init__(self, field):
+        self._start = re.compile(r'"' + re.escape(field) + r'"\s*:\s*"')
+        self._buffer = ''
+        self._pos = None
+        self.done = False
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        if self.done:
+            return ''
+        if self._pos is None:
+            match = self._start.search(self._buffer)
+            if match is None:
+                return ''
+            self._pos = match.end()
+
+        out = []
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char == '"':
+                self.done = True
+                pos += 1
+                break
+            if char != '\\':
+                out.append(char)
+                pos += 1
+                continue
+            # Escape sequence; wait for more input if it is cut off
+            if pos + 1 >= len(buffer):
+                break
+            code = buffer[pos + 1]
+            if code == 'u':
+                if pos + 6 > len(buffer):
+                    break
+                codepoint = int(buffer[pos + 2:pos + 6], 16)
+                if 0xD800 <= codepoint < 0xDC00:
+                    # High surrogate, combine it with the low one that follows
+                    if pos + 12 > len(buffer):
+                        break
+                    low = int(buffer[pos + 8:pos + 12], 16)
+                    codepoint = 0x10000 + ((codepoint - 0xD800) << 10) + (low - 0xDC00)
+                    pos += 6
+                out.append(chr(codepoint))
+                pos += 6
+            else:
+                out.append(_ESCAPES.get(code, code))
+                pos += 2
+        self._pos = pos
+        return ''.join(out)
+
+
+class ResponseFormatError(ValueError):
+    """Raised when a model response holds no usable JSON object.
+
+    `reason` is 'no_json' when no JSON object could be found and 'schema'
+    when the object does not match RESPONSE_SCHEMA.
+    """
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+
+class JSONObjectScanner:
+    """Finds the first balanced JSON object in text that arrives in chunks.
+
+    Braces are counted outside of JSON strings, so the scan is a single pass
+    over the input; markdown fences or prose around the object are skipped.
+    A balanced candidate that does not parse (such as a brace in the prose)
+    is dropped and the scan resumes right after its opening brace.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self.result = None
+
+    def feed(self, chunk):
+        """Returns the parsed object once it is complete, otherwise None."""
+        self._buffer += chunk
+        if self.result is not None:
+            return self.result
+
+        buffer, pos = self._buffer, self._pos
+        while pos < len(buffer):
+            char = buffer[pos]
+            if self._start is None:
+                if char == '{':
+                    self._start, self._depth, self._in_string, self._escaped = pos, 1, False, False
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        value = json.loads(buffer[self._start:pos + 1])
+                    except ValueError:
+                        value = None
+                    if isinstance(value, dict):
+                        self.result = value
+                        self._pos = pos + 1
+                        return value
+                    pos = self._start
+                    self._start = None
+            pos += 1
+        self._pos = pos
+        return None
+
+    def finish(self):
+        """Returns the object at the end of the input, or None.
+
+        An opening brace that was never closed (a stray brace in prose before
+        the real object) is skipped and the rest of the input scanned again.
+        """
+        while self.result is None and self._start is not None:
+            self._pos = self._start + 1
+            self._start = None
+            self.feed('')
+        return self.result
+
+
+def extract_json_object(text):
+    """Returns the first JSON object in `text`."""
+    scanner = JSONObjectScanner()
+    scanner.feed(text)
+    data = scanner.finish()
+    if data is None:
+        raise ResponseFormatError('No JSON object found in the response.', 'no_json')
+    return data
+
+
+# Expected shape of a model response: a type, a list of one type, or a nested
+# schema. Only the fields in REQUIRED_FIELDS must be present.
+RESPONSE_SCHEMA = {
+    'title': str,
+    'refined_prompt': str,
+    'generated_content': str,
+    'analysis': {
+        'overall_score': int,
+        'clarity': int,
+        'specificity': int,
+        'effectiveness': int,
+        'improvements_made': [str],
+        'additional_suggestions': [str],
+    },
+}
+REQUIRED_FIELDS = ('generated_content',)
+
+
+def _coerce(value, expected, path):
+    if value is None:
+        return None
+    if isinstance(expected, dict):
+        if not isinstance(value, dict):
+            raise ResponseFormatError(f'{path} must be an object.', 'schema')
+        return {key: _coerce(value.get(key), schema, f'{path}.{key}') for key, schema in expected.items()}
+    if isinstance(expected, list):
+        # A lone item where a list was expected is accepted as a one-item list
+        items = value if isinstance(value, list) else [value]
+        return [_coerce(item, expected[0], f'{path}[{i}]') for i, item in enumerate(items)]
+    if expected is int:
+        # Scores sometimes come back as floats or numeric strings
+        try:
+            if isinstance(value, str):
+                value = float(value)
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+                return int(round(value))
+        except (ValueError, OverflowError):
+            pass
+        raise ResponseFormatError(f'{path} must be a number.', 'schema')
+    if not isinstance(value, expected):
+        raise ResponseFormatError(f'{path} must be a {expected.__name__}.', 'schema')
+    return value
+
+
+def validate_response(data):
+    """Checks a parsed model response against RESPONSE_SCHEMA.
+
+    Returns a normalized copy holding only the known fields, with missing
+    optional fields set to None.
+    """
+    for field in REQUIRED_FIELDS:
+        if data.get(field) is None:
+            raise ResponseFormatError(f'The response has no {field}.', 'schema')
+    return _coerce(data, RESPONSE_SCHEMA, 'response')
@@ -0,0 +1,304 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, jsonify, request
+from logger import logger
+
+# Endpoints rate limited as a class of their own; other API endpoints fall
+# under 'default'
+ROUTE_CLASSES = {
+    'api.generate_prompt': 'generate',
+    'api.generate_prompts_batch': 'generate',
+    'api.stream_generate_prompt': 'generate',
+    'api.search_public_prompts': 'search',
+    'api.get_public_tags': 'search',
+}
+
+_PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(value):
+    """Parses a limit such as '20/minute' into `(rate per second, burst)`.
+
+    Returns None for an empty value, which disables the limit.
+    """
+    if not value:
+        return None
+    count, _, period = value.partition('/')
+    return int(count) / _PERIODS[period.strip() or 'second'], int(count)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate` tokens per second.
+
+    Holds at most `capacity` tokens, which bounds the burst size. A rate of 0
+    disables the limit.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self._tokens = float(self.capacity)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+        # Tokens taken since the last sync with a shared store
+        self.consumed = 0
+        self.last_used = self._updated_at
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def reserve(self, tokens=1):
+        """Takes `tokens` and returns how many seconds to wait before using them.
+
+        The balance may go negative, so concurrent callers are served in the
+        order they reserved.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        """Blocks until `tokens` are available."""
+        wait = self.reserve(tokens)
+        if wait:
+            time.sleep(wait)
+
+    def try_acquire(self, tokens=1):
+        """Takes `tokens` if available; otherwise returns the seconds until they are.
+
+        Returns 0 when the tokens were taken.
+        """
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill()
+            self.last_used = self._updated_at
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                self.consumed += tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def refund(self, tokens=1):
+        """Gives back tokens taken by try_acquire for a request that did not proceed."""
+        if not self.rate:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+            self.consumed -= tokens
+
+    def take_consumed(self):
+        with self._lock:
+            consumed, self.consumed = self.consumed, 0
+            return consumed
+
+    def rebase(self, tokens):
+        """Adopts a balance from a shared store, minus what was taken since."""
+        with self._lock:
+            self._tokens = min(self.capacity, tokens - self.consumed)
+            self._updated_at = time.monotonic()
+
+
+class MemoryBucketStore:
+    """Token buckets of one process, keyed by route class and client.
+
+    The least recently used buckets are dropped beyond `maxsize` keys; a
+    dropped bucket comes back full, which only ever favours idle clients.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def bucket(self, key, rate, capacity):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate, capacity)
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket
+
+    def take(self, key, rate, capacity, tokens=1):
+        """Returns 0 if the request may proceed, otherwise the seconds to wait."""
+        return self.bucket(key, rate, capacity).try_acquire(tokens)
+
+    def refund(self, key, rate, capacity, tokens=1):
+        self.bucket(key, rate, capacity).refund(tokens)
+
+    def recent(self, since):
+        with self._lock:
+            return [(key, bucket) for key, bucket in self._buckets.items() if bucket.last_used >= since]
+
+
+class SQLiteBucketStore(MemoryBucketStore):
+    """Token buckets shared by the worker processes through a SQLite file.
+
+    Requests only ever touch the in-process buckets. A background thread
+    merges what they consumed into the shared file every `sync_interval`
+    seconds and adopts the shared balance, so across N processes a client
+    can overshoot its limit by at most N intervals' worth of refill.
+    """
+
+    def __init__(self, path, sync_interval=0.5, maxsize=100000):
+        super().__init__(maxsize)
+        self.path = path
+        self.sync_interval = sync_interval
+        self._pid = None
+        self._purged_at = 0
+
+    def take(self, key, rate, capacity, tokens=1):
+        if self._pid != os.getpid():
+            self._start()
+        return super().take(key, rate, capacity, tokens)
+
+    def _start(self):
+        with self._lock:
+            # Started lazily, and again in each forked worker
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        connection = self._connect()
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_bucket "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        connection.close()
+        threading.Thread(target=self._run, name='rate-limit-sync', daemon=True).start()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        return connection
+
+    def _run(self):
+        connection = self._connect()
+        while True:
+            time.sleep(self.sync_interval)
+            try:
+                self.sync(connection)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to sync rate limit buckets: {e}")
+
+    def sync(self, connection):
+        # Buckets idle for longer than it takes them to refill need no sync
+        now = time.time()
+        buckets = self.recent(time.monotonic() - 60)
+        if not buckets:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for key, bucket in buckets:
+                consumed = bucket.take_consumed()
+                key_text = '|'.join(key)
+                row = connection.execute(
+                    "SELECT tokens, updated_at FROM rate_limit_bucket WHERE key = ?", (key_text,)
+                ).fetchone()
+                tokens = bucket.capacity if row is None else \
+                    min(bucket.capacity, row[0] + (now - row[1]) * bucket.rate)
+                tokens = max(tokens - consumed, -bucket.capacity)
+                connection.execute(
+                    "INSERT OR REPLACE INTO rate_limit_bucket (key, tokens, updated_at) VALUES (?, ?, ?)",
+                    (key_text, tokens, now),
+                )
+                bucket.rebase(tokens)
+            if now - self._purged_at > 600:
+                self._purged_at = now
+                connection.execute("DELETE FROM rate_limit_bucket WHERE updated_at < ?", (now - 86400,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+
+class RateLimiter:
+    """Per-client and global token buckets for each route class.
+
+    Clients are identified by the user id in their token, or by IP address
+    for anonymous requests. Limits come from RATE_LIMITS (per client) and
+    GLOBAL_RATE_LIMITS (all clients together), as 'count/period' strings.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.auth_cache = app.extensions['auth_cache']
+        self.enabled = config['RATE_LIMIT_ENABLED']
+        self.limits = {name: parse_limit(value) for name, value in config['RATE_LIMITS'].items()}
+        self.global_limits = {name: parse_limit(value) for name, value in config['GLOBAL_RATE_LIMITS'].items()}
+        if config['RATE_LIMIT_STORE'] == 'sqlite':
+            self.store = SQLiteBucketStore(
+                config['RATE_LIMIT_STORE_PATH'],
+                sync_interval=config['RATE_LIMIT_SYNC_INTERVAL'],
+                maxsize=config['RATE_LIMIT_MAX_KEYS'],
+            )
+        else:
+            self.store = MemoryBucketStore(maxsize=config['RATE_LIMIT_MAX_KEYS'])
+
+    def check(self, route_class, client, cost=1):
+        """Returns 0 if the request may proceed, otherwise the seconds until it may."""
+        if not self.enabled:
+            return 0.0
+        client_limit = self.limits.get(route_class)
+        if client_limit:
+            client_tokens = min(cost, client_limit[1])
+            wait = self.store.take((route_class, client), *client_limit, tokens=client_tokens)
+            if wait:
+                return wait
+        limit = self.global_limits.get(route_class)
+        if limit:
+            wait = self.store.take((route_class, '*'), *limit, tokens=min(cost, limit[1]))
+            if wait and client_limit:
+                # Rejected by the global limit: the client does not pay for it
+                self.store.refund((route_class, client), *client_limit, tokens=client_tokens)
+            return wait
+        return 0.0
+
+    def client_key(self, token, remote_addr):
+        if token:
+            try:
+                return f"user:{self.auth_cache.decode_token(token)['user_id']}"
+            except Exception:
+                pass
+        return f"ip:{remote_addr}"
+
+
+def limit_request():
+    """before_request hook rejecting API requests over their rate limit."""
+    if not request.endpoint or not request.endpoint.startswith('api.'):
+        return None
+    limiter = current_app.extensions['rate_limiter']
+    route_class = ROUTE_CLASSES.get(request.endpoint, 'default')
+    cost = 1
+    if request.endpoint == 'api.generate_prompts_batch':
+        # Each prompt of a batch counts as one generation
+        prompt_ids = (request.get_json(silent=True) or {}).get('prompt_ids')
+        cost = max(len(prompt_ids), 1) if isinstance(prompt_ids, list) else 1
+    client = limiter.client_key(request.headers.get('x-access-token'), request.remote_addr)
+    wait = limiter.check(route_class, client, cost)
+    if wait:
+        logger.info(f"Rate limited {client} on {route_class} requests for {wait:.1f}s.")
+        return jsonify({'message': 'Too many requests, please slow down.'}), 429, {'Retry-After': str(math.ceil(wait))}
+    return None
+
+
+def init_app(app):
+    config = app.config
+    app.extensions['model_rate_limit'] = TokenBucket(config['MODEL_RATE_LIMIT'], config['MODEL_RATE_BURST'])
+    app.extensions['rate_limiter'] = RateLimiter(app)
+    app.before_request(limit_request)
+
+
+def get_model_rate_limit():
+    return current_app.extensions['model_rate_limit']
@@ -0,0 +1,97 @@
+import sqlite3
+import time
+from functools import wraps
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from cache import TTLCache
+from database import db, RoutingSession
+from logger import logger
+
+
+class ReplicaRouter:
+    """Decides which reads may be served from the read replica.
+
+    Users who wrote recently are remembered for `sticky_seconds`, about the
+    replication lag, and their reads stay on the primary meanwhile. The
+    memory is per process: with several workers, a read served by another
+    worker than the write can still miss it within that window.
+    """
+
+    def __init__(self, app):
+        self.enabled = 'replica' in app.config['SQLALCHEMY_BINDS']
+        self.recent_writers = TTLCache(maxsize=100000, ttl=app.config['REPLICA_STICKY_SECONDS'])
+
+    def mark_write(self, user_id):
+        if self.enabled and user_id is not None:
+            self.recent_writers.set(user_id, True)
+
+    def use_replica(self, user_id):
+        return self.enabled and self.recent_writers.get(user_id) is None
+
+
+def read_replica(f):
+    """Serves a read-only view from the replica, below auth_required.
+
+    The user is loaded from the primary by auth_required; queries of the
+    view itself go to the replica unless the user wrote recently.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if get_replica_router().use_replica(current_user.id):
+            db.session.info['use_replica'] = True
+        try:
+            return f(current_user, *args, **kwargs)
+        finally:
+            db.session.info.pop('use_replica', None)
+    return decorated
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_write(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _note_bulk_write(orm_execute_state):
+    if orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _remember_writer(session):
+    # The session's user is set by auth_required and by generation jobs
+    if session.info.pop('wrote', False):
+        get_replica_router().mark_write(session.info.get('user_id'))
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _forget_write(session):
+    session.info.pop('wrote', None)
+
+
+def sync_sqlite_replica(primary_engine, replica_engine):
+    """Copies the primary SQLite database over the replica file.
+
+    A local stand-in for streaming replication: the copy goes through the
+    SQLite backup API, so it is consistent even while the app writes.
+    """
+    if primary_engine.dialect.name != 'sqlite' or replica_engine.dialect.name != 'sqlite':
+        raise ValueError("Only SQLite databases can be synced; server replicas stream from their primary.")
+    source = sqlite3.connect(make_url(primary_engine.url).database, timeout=30)
+    target = sqlite3.connect(make_url(replica_engine.url).database, timeout=30)
+    try:
+        started = time.perf_counter()
+        source.backup(target)
+        logger.info(f"Synced the replica in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    finally:
+        target.close()
+        source.close()
+
+
+def init_app(app):
+    app.extensions['replica_router'] = ReplicaRouter(app)
+
+
+def get_replica_router():
+    return current_app.extensions['replica_router']
@@ -1,35 +1,114 @@
 import json
-import traceback
 from functools import wraps
-from flask import jsonify, request, Blueprint, current_app
-from database import db, Prompt, GeneratedPrompt, User, TokenBlacklist, PromptVote
-from services import model
+from werkzeug.http import parse_etags, quote_etag
+from flask import jsonify, request, Blueprint, current_app, make_response, url_for, Response, stream_with_context
+from database import db, CatalogueVersion, Prompt, PromptStats, GeneratedPrompt, GenerationJob, User, UserStats, TokenBlacklist, PromptVote, Tag, parse_tags, serialize_prompts
+from services import model, GenerationError, generate_for_prompt, generate_from_cache, generate_batch, render_system_prompt, stream_generation
+from tokens import QuotaExceeded, TokenBudgetError, get_token_budget
+from jobs import get_job_queue, QueueFull
 from logger import logger
+from metrics import metrics
+from pagination import paginate, PaginationError
+from search import search_prompts, FILTER_FIELDS
+from sqlalchemy.orm import joinedload
+from cache import TTLCache
+from auth import get_auth_cache
+from replica import read_replica
+from catalogue_cache import cached_catalogue_page
+from transfer import export_prompts, iter_lines, PromptImporter
 import jwt
 from datetime import datetime, timedelta
 import uuid
 
 api_bp = Blueprint('api', __name__)
 
+# Tag facet counts of the public catalogue, cleared whenever it changes
+tag_facets_cache = TTLCache(maxsize=1)
+
+PROMPT_SORT_KEYS = {
+    'newest': [(Prompt.created_at, True), (Prompt.id, True)],
+    'oldest': [(Prompt.created_at, False), (Prompt.id, False)],
+    'top': [(Prompt.score, True), (Prompt.id, True)],
+    'hot': [(Prompt.hot_score, True), (Prompt.id, True)],
+}
+
+# Sort keys missing from Prompt.to_dict(), added to the listed prompts for the cursor
+PROMPT_SORT_EXTRA = {'hot': ('hot_score',)}
+
+def prompt_sort(sort_order):
+    """Returns the `(keys, extra)` of a listing order, see PROMPT_SORT_EXTRA."""
+    keys = PROMPT_SORT_KEYS.get(sort_order, PROMPT_SORT_KEYS['newest'])
+    return keys, PROMPT_SORT_EXTRA.get(sort_order, ())
+
+def prompt_page(query, sort_order='newest'):
+    """Returns a keyset-paginated JSON page of prompts."""
+    keys, extra = prompt_sort(sort_order)
+    try:
+        prompts, next_cursor = paginate(query, keys, lambda page: serialize_prompts(page, *extra))
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'prompts': prompts, 'next_cursor': next_cursor})
+
+def etag_matches(if_none_match, etag):
+    """Tells whether an If-None-Match header value names `etag`."""
+    return parse_etags(if_none_match).contains_weak(etag)
+
+def validator_headers(etag):
+    """Headers of a response that must be revalidated against its ETag before reuse."""
+    return {'ETag': quote_etag(etag), 'Cache-Control': 'private, no-cache'}
+
+def conditional(etag, build):
+    """Answers 304 if the client already holds `etag`, otherwise with build().
+
+    Successful responses carry the ETag and must be revalidated before reuse,
+    so the view only builds the body when the version changed.
+    """
+    if etag_matches(request.headers.get('If-None-Match'), etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    response.headers.update(validator_headers(etag))
+    return response
+
+def prompt_etag(prompt):
+    return f"prompt-{prompt.id}-{prompt.updated_at:%Y%m%d%H%M%S%f}"
+
+def catalogue_etag():
+    return f"public-{CatalogueVersion.current()}"
+
+def authenticate(token):
+    """Checks an access token and loads its user into the session.
+
+    Returns `(user, None)`, or `(None, body)` with the JSON body of the 401
+    response. Shared by auth_required and the native ASGI mode.
+    """
+    if not token:
+        return None, {'message': 'Token is missing!'}
+    try:
+        auth_cache = get_auth_cache()
+        data = auth_cache.decode_token(token)
+        token_jti = data.get('jti')
+        if not token_jti or auth_cache.is_revoked(token_jti):
+            return None, {'message': 'Token has been revoked'}
+        user = auth_cache.load_user(data['user_id'])
+    except Exception as e:
+        return None, {'message': 'Token is invalid!', 'error': str(e)}
+    # The user may have been deleted while their token is still valid
+    if user is None:
+        return None, {'message': 'Token is invalid!', 'error': 'User not found'}
+    return user, None
+
 def auth_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-        if 'x-access-token' in request.headers:
-            token = request.headers['x-access-token']
-
-        if not token:
-            return jsonify({'message': 'Token is missing!'}), 401
-
-        try:
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"])
-            current_user = User.query.get(data['user_id'])
-            token_jti = data.get('jti')
-            if not token_jti or TokenBlacklist.query.filter_by(jti=token_jti).first():
-                return jsonify({'message': 'Token has been revoked'}), 401
-        except Exception as e:
-            return jsonify({'message': 'Token is invalid!', 'error': str(e)}), 401
+        current_user, error = authenticate(request.headers.get('x-access-token'))
+        if error is not None:
+            return jsonify(error), 401
 
+        # Lets the replica router keep this user's reads on the primary after a write
+        db.session.info['user_id'] = current_user.id
         return f(current_user, *args, **kwargs)
     return decorated
 
@@ -66,9 +145,11 @@ def logout(current_user):
         data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=["HS256"], options={"verify_exp": False})
         token_jti = data.get('jti')
         if token_jti:
-            blacklisted_token = TokenBlacklist(jti=token_jti)
+            expires_at = datetime.utcfromtimestamp(data['exp']) if 'exp' in data else datetime.utcnow() + timedelta(hours=24)
+            blacklisted_token = TokenBlacklist(jti=token_jti, expires_at=expires_at)
             db.session.add(blacklisted_token)
             db.session.commit()
+            get_auth_cache().revoke(token, token_jti)
             return jsonify({'message': 'Successfully logged out'}), 200
         else:
             return jsonify({'message': 'Invalid token'}), 400
@@ -92,9 +173,9 @@ def create_prompt(current_user):
         text=data['text'],
         intended_use=data.get('intended_use'),
         target_audience=data.get('target_audience'),
-        expected_outcome=data.get('expected_outcome'),
-        tags=data.get('tags')
+        expected_outcome=data.get('expected_outcome')
     )
+    new_prompt.set_tags(data.get('tags'))
     db.session.add(new_prompt)
     db.session.commit()
     logger.info(f"Prompt {new_prompt.id} created successfully.")
@@ -105,9 +186,9 @@ def create_prompt(current_user):
 def get_prompt(current_user, prompt_id):
     logger.info(f"Fetching prompt {prompt_id}.")
     prompt = Prompt.query.get_or_404(prompt_id)
-    if not prompt.is_shared and prompt.user_id != current_user.id:
+    if not prompt.visible_to(current_user.id):
         return jsonify({'message': 'Access forbidden!'}), 403
-    return jsonify(prompt.to_dict())
+    return conditional(prompt_etag(prompt), lambda: jsonify(prompt.to_dict()))
 
 @api_bp.route('/prompts/<int:prompt_id>', methods=['PUT'])
 @auth_required
@@ -122,8 +203,11 @@ def update_prompt(current_user, prompt_id):
     prompt.intended_use = data.get('intended_use', prompt.intended_use)
     prompt.target_audience = data.get('target_audience', prompt.target_audience)
     prompt.expected_outcome = data.get('expected_outcome', prompt.expected_outcome)
-    prompt.tags = data.get('tags', prompt.tags)
+    if 'tags' in data:
+        prompt.set_tags(data['tags'])
     db.session.commit()
+    if prompt.is_shared:
+        tag_facets_cache.clear()
     logger.info(f"Prompt {prompt_id} updated successfully.")
     return jsonify(prompt.to_dict())
 
@@ -134,8 +218,11 @@ def delete_prompt(current_user, prompt_id):
     prompt = Prompt.query.get_or_404(prompt_id)
     if prompt.user_id != current_user.id:
         return jsonify({'message': 'Access forbidden!'}), 403
+    was_shared = prompt.is_shared
     db.session.delete(prompt)
     db.session.commit()
+    if was_shared:
+        tag_facets_cache.clear()
     logger.info(f"Prompt {prompt_id} deleted successfully.")
     return jsonify({'message': 'Prompt deleted successfully'})
 
@@ -143,22 +230,40 @@ def delete_prompt(current_user, prompt_id):
 @auth_required
 def get_prompts(current_user):
     sort_order = request.args.get('sort', 'newest')
+    if sort_order not in ('newest', 'oldest'):
+        sort_order = 'newest'
     query = Prompt.query.filter_by(user_id=current_user.id)
+    return prompt_page(query, sort_order)
 
-    if sort_order == 'newest':
-        query = query.order_by(Prompt.created_at.desc())
-    elif sort_order == 'oldest':
-        query = query.order_by(Prompt.created_at.asc())
+@api_bp.route('/prompts/export', methods=['GET'])
+@auth_required
+def export_user_prompts(current_user):
+    logger.info(f"Exporting prompts of user {current_user.id}.")
+    lines = export_prompts(current_user.id, current_app.config['EXPORT_BATCH_SIZE'])
+    headers = {'Content-Disposition': 'attachment; filename=prompts.ndjson'}
+    return Response(stream_with_context(lines), mimetype='application/x-ndjson', headers=headers)
 
-    prompts = query.all()
-    return jsonify([prompt.to_dict() for prompt in prompts])
+@api_bp.route('/prompts/import', methods=['POST'])
+@auth_required
+def import_user_prompts(current_user):
+    """Creates prompts from an NDJSON body, one prompt object per line."""
+    config = current_app.config
+    importer = PromptImporter(current_user.id, config['IMPORT_CHUNK_SIZE'], config['IMPORT_MAX_ERRORS'])
+    result = importer.run(iter_lines(request.stream))
+    if importer.shared:
+        tag_facets_cache.clear()
+    logger.info(f"Imported {result['imported']} prompts for user {current_user.id}, {result['failed']} failed.")
+    return jsonify(result), 200 if result['imported'] or not result['failed'] else 400
 
 @api_bp.route('/prompts/public', methods=['GET'])
 @auth_required
+@read_replica
+@cached_catalogue_page
 def get_public_prompts(current_user):
     logger.info("Fetching public prompts.")
-    prompts = Prompt.query.filter_by(is_shared=True).all()
-    return jsonify([prompt.to_dict() for prompt in prompts])
+    sort_order = request.args.get('sort', 'newest')
+    query = Prompt.query.filter_by(is_shared=True)
+    return conditional(catalogue_etag(), lambda: prompt_page(query, sort_order))
 
 @api_bp.route('/prompts/<int:prompt_id>/publish', methods=['PUT'])
 @auth_required
@@ -169,122 +274,255 @@ def publish_prompt(current_user, prompt_id):
         return jsonify({'message': 'Access forbidden!'}), 403
     prompt.is_shared = True
     db.session.commit()
+    tag_facets_cache.clear()
     logger.info(f"Prompt {prompt_id} published successfully.")
     return jsonify(prompt.to_dict())
 
 @api_bp.route('/prompts/public/search', methods=['GET'])
 @auth_required
+@read_replica
+@cached_catalogue_page
 def search_public_prompts(current_user):
-    query_params = request.args
+    logger.info("Searching public prompts.")
+    return conditional(catalogue_etag(), lambda: search_page(request.args))
+
+def search_page(query_params):
+    """Returns a JSON page of shared prompts matching the search parameters."""
+    filters = {field: query_params[field] for field in FILTER_FIELDS if query_params.get(field)}
     query = Prompt.query.filter_by(is_shared=True)
 
-    if 'tags' in query_params:
-        query = query.filter(Prompt.tags.ilike(f"%{query_params['tags']}%"))
-    if 'intended_use' in query_params:
-        query = query.filter(Prompt.intended_use.ilike(f"%{query_params['intended_use']}%"))
-    if 'target_audience' in query_params:
-        query = query.filter(Prompt.target_audience.ilike(f"%{query_params['target_audience']}%"))
+    tag_names = parse_tags(query_params.get('tags'))
+    if tag_names:
+        match_all = query_params.get('tag_mode', 'all') != 'any'
+        query = query.filter(Prompt.tag_filter(tag_names, match_all=match_all))
+    query, rank = search_prompts(query, q=query_params.get('q'), filters=filters)
+    if rank is None:
+        return prompt_page(query)
+
+    # Ranked results: best matches first, ties broken by id
+    def serialize_ranked(page_query):
+        rows = page_query.options(joinedload(Prompt.author)).add_columns(rank).all()
+        return [dict(prompt.to_dict(), rank=prompt_rank) for prompt, prompt_rank in rows]
 
-    prompts = query.all()
-    logger.info(f"Found {len(prompts)} prompts matching search criteria.")
-    return jsonify([prompt.to_dict() for prompt in prompts])
+    try:
+        prompts, next_cursor = paginate(query, [(rank, False), (Prompt.id, False)], serialize_ranked)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'prompts': prompts, 'next_cursor': next_cursor})
+
+@api_bp.route('/prompts/public/tags', methods=['GET'])
+@auth_required
+def get_public_tags(current_user):
+    facets = tag_facets_cache.get('facets')
+    if facets is None:
+        logger.info("Computing tag facet counts.")
+        rows = Tag.facet_counts(current_app.config['TAG_FACETS_SIZE'])
+        facets = [{'tag': name, 'count': count} for name, count in rows]
+        tag_facets_cache.set('facets', facets, ttl=current_app.config['TAG_FACETS_CACHE_TTL'])
+    return jsonify(facets)
+
+def check_token_budget(prompt, user):
+    """Rejects a generation the token budget would not allow before it is queued."""
+    _, estimated = render_system_prompt(prompt)
+    get_token_budget().check_quota(user.id, estimated)
+
+def token_budget_error(e):
+    if isinstance(e, QuotaExceeded):
+        return jsonify({'error': str(e)}), 429, {'Retry-After': str(e.retry_after)}
+    return jsonify({'error': str(e)}), 413
 
 @api_bp.route('/prompts/<int:prompt_id>/generate', methods=['POST'])
 @auth_required
 def generate_prompt(current_user, prompt_id):
     logger.info(f"Generating content for prompt {prompt_id}.")
     prompt = Prompt.query.get_or_404(prompt_id)
-    if not prompt.is_shared and prompt.user_id != current_user.id:
+    if not prompt.visible_to(current_user.id):
         return jsonify({'message': 'Access forbidden!'}), 403
 
     if not model:
         return jsonify({"error": "Generative model not available. Check GOOGLE_API_KEY."}), 503
 
-    # Build the prompt text from the prompt's attributes
-    user_prompt_text = f"""
-    Prompt: {prompt.text}
-    Intended Use: {prompt.intended_use}
-    Target Audience: {prompt.target_audience}
-    Expected Outcome: {prompt.expected_outcome}
-    """
+    # Cache hits are answered right away; `fresh=true` forces a new model call
+    fresh = request.args.get('fresh', 'false').lower() == 'true'
+    # `sync=true` waits for the generation instead of queueing a job
+    if request.args.get('sync', 'false').lower() == 'true':
+        try:
+            generated_prompt = generate_for_prompt(prompt, fresh=fresh, user_id=current_user.id)
+        except TokenBudgetError as e:
+            return token_budget_error(e)
+        except GenerationError as e:
+            db.session.rollback()
+            logger.error(f"Generation failed for prompt {prompt_id}: {e}")
+            return jsonify({'error': str(e)}), 502
+        return jsonify(generated_prompt.to_dict())
 
-    system_prompt = f"""
-    You are a prompt engineering expert. Your task is to analyze a user's prompt and then generate a response based on a refined version of that prompt.
-    Please analyze the following user prompt and provide a response in a single JSON object with the following structure:
-    {{
-      "title": "<A concise title for the prompt, maximum 25 characters>",
-      "analysis": {{
-        "overall_score": <an integer score out of 10 for the prompt>,
-        "clarity": <an integer score out of 10>,
-        "specificity": <an integer score out of 10>,
-        "effectiveness": <an integer score out of 10>,
-        "improvements_made": ["<a list of strings describing improvements made>"],
-        "additional_suggestions": ["<a list of strings for further suggestions>"]
-      }},
-      "refined_prompt": "<your refined version of the user's prompt>",
-      "generated_content": "<the content generated by executing the refined prompt>"
-    }}
-
-    Here is the user's prompt to analyze:
-    ---
-    {user_prompt_text.strip()}
-    ---
-    """
+    try:
+        if not fresh:
+            generated_prompt = generate_from_cache(prompt, user_id=current_user.id)
+            if generated_prompt is not None:
+                return jsonify(generated_prompt.to_dict())
+        check_token_budget(prompt, current_user)
+    except TokenBudgetError as e:
+        return token_budget_error(e)
 
     try:
-        response = model.generate_content(system_prompt.strip())
-        logger.info(f"Raw response from Gemini for prompt {prompt_id}: {response.text}")
-        
-        # The response from the model is a JSON string, so we need to parse it
+        job = get_job_queue().submit(prompt, current_user, fresh=fresh)
+    except QueueFull:
+        return jsonify({"error": "Too many generations in progress, please retry shortly."}), 503, {'Retry-After': '5'}
+
+    status_url = url_for('api.get_job', job_id=job.id)
+    return jsonify({'job_id': job.id, 'status': job.status, 'status_url': status_url}), 202, {'Location': status_url}
+
+@api_bp.route('/prompts/generate:batch', methods=['POST'])
+@auth_required
+def generate_prompts_batch(current_user):
+    data = request.get_json(silent=True) or {}
+    prompt_ids = data.get('prompt_ids')
+    if not isinstance(prompt_ids, list) or not prompt_ids or not all(type(i) is int for i in prompt_ids):
+        return jsonify({'message': 'prompt_ids must be a non-empty list of prompt ids.'}), 400
+    prompt_ids = list(dict.fromkeys(prompt_ids))
+    max_size = current_app.config['GENERATION_BATCH_MAX_SIZE']
+    if len(prompt_ids) > max_size:
+        return jsonify({'message': f'A batch can contain at most {max_size} prompts.'}), 400
+    logger.info(f"Generating content for a batch of {len(prompt_ids)} prompts.")
+
+    if not model:
+        return jsonify({"error": "Generative model not available. Check GOOGLE_API_KEY."}), 503
+
+    results = {}
+    prompts = []
+    found = {prompt.id: prompt for prompt in Prompt.query.filter(Prompt.id.in_(prompt_ids))}
+    for prompt_id in prompt_ids:
+        prompt = found.get(prompt_id)
+        if prompt is None:
+            results[prompt_id] = {'prompt_id': prompt_id, 'status': 'failed', 'error': 'Not Found'}
+        elif not prompt.visible_to(current_user.id):
+            results[prompt_id] = {'prompt_id': prompt_id, 'status': 'failed', 'error': 'Access forbidden!'}
+        else:
+            prompts.append(prompt)
+
+    fresh = request.args.get('fresh', 'false').lower() == 'true'
+    outcomes = generate_batch(prompts, fresh=fresh, concurrency=current_app.config['GENERATION_BATCH_CONCURRENCY'],
+                              user_id=current_user.id)
+    for prompt_id, outcome in outcomes.items():
+        if isinstance(outcome, Exception):
+            results[prompt_id] = {'prompt_id': prompt_id, 'status': 'failed', 'error': str(outcome)}
+        else:
+            results[prompt_id] = {'prompt_id': prompt_id, 'status': 'succeeded', 'result': outcome.to_dict()}
+    return jsonify({'results': [results[prompt_id] for prompt_id in prompt_ids]})
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@api_bp.route('/prompts/<int:prompt_id>/generate/stream', methods=['POST'])
+@auth_required
+def stream_generate_prompt(current_user, prompt_id):
+    logger.info(f"Streaming content generation for prompt {prompt_id}.")
+    prompt = Prompt.query.get_or_404(prompt_id)
+    if not prompt.visible_to(current_user.id):
+        return jsonify({'message': 'Access forbidden!'}), 403
+
+    if not model:
+        return jsonify({"error": "Generative model not available. Check GOOGLE_API_KEY."}), 503
+
+    fresh = request.args.get('fresh', 'false').lower() == 'true'
+    try:
+        check_token_budget(prompt, current_user)
+    except TokenBudgetError as e:
+        return token_budget_error(e)
+
+    def events():
+        # Sent straight away so the client sees the stream open immediately
+        yield sse_event('status', {'status': 'started'})
         try:
-            # It's possible the model wraps the JSON in markdown, so we'll try to extract it
-            clean_response = response.text.strip().replace('```json', '').replace('```', '')
-            data = json.loads(clean_response)
-        except json.JSONDecodeError:
-            logger.error(f"JSONDecodeError for prompt {prompt_id}. Unable to parse model response.")
-            return jsonify({"error": "The AI model returned a response that was not valid JSON.", "raw_response": response.text}), 500
-
-        analysis = data.get('analysis', {})
-        
-        # If the prompt doesn't have a title, update it with the generated one
-        generated_title = data.get('title')
-        if generated_title and not prompt.title:
-            prompt.title = generated_title[:25] # Enforce max length
-
-        # Save the generated prompt to the database
-        new_generated_prompt = GeneratedPrompt(
-            prompt_id=prompt.id,
-            generated_text=data.get('generated_content'),
-            prompt_token_count=response.usage_metadata.prompt_token_count,
-            candidates_token_count=response.usage_metadata.candidates_token_count,
-            overall_score=analysis.get('overall_score'),
-            clarity=analysis.get('clarity'),
-            specificity=analysis.get('specificity'),
-            effectiveness=analysis.get('effectiveness'),
-            refined_prompt=data.get('refined_prompt'),
-            improvements_made=analysis.get('improvements_made'),
-            additional_suggestions=analysis.get('additional_suggestions')
-        )
-        db.session.add(new_generated_prompt)
-        db.session.commit()
-        logger.info(f"Content generated and saved for prompt {prompt_id}.")
-
-        return jsonify(new_generated_prompt.to_dict())
-    except Exception as e:
-        traceback.print_exc()
-        logger.error(f"Error generating content for prompt {prompt_id}: {e}")
-        return jsonify({"error": str(e)}), 500
+            for event, payload in stream_generation(prompt, fresh=fresh, user_id=current_user.id):
+                if event == 'delta':
+                    yield sse_event('delta', {'text': payload})
+                else:
+                    yield sse_event('done', payload.to_dict())
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error streaming content for prompt {prompt_id}: {e}")
+            yield sse_event('error', {'error': str(e), 'raw_response': getattr(e, 'raw_response', None)})
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+@api_bp.route('/jobs/<job_id>', methods=['GET'])
+@auth_required
+def get_job(current_user, job_id):
+    job = GenerationJob.query.get_or_404(job_id)
+    if job.user_id != current_user.id:
+        return jsonify({'message': 'Access forbidden!'}), 403
+
+    # Long-poll: hold the request until the job finishes or `wait` expires
+    wait = min(request.args.get('wait', 0, type=float), current_app.config['JOB_MAX_WAIT'])
+    if wait > 0 and not job.finished:
+        get_job_queue().wait(job.id, wait)
+        db.session.refresh(job)
+    return jsonify(job.to_dict())
+
+@api_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @api_bp.route('/prompts/<int:prompt_id>/history', methods=['GET'])
 @auth_required
+@read_replica
 def get_generation_history(current_user, prompt_id):
     logger.info(f"Fetching generation history for prompt {prompt_id}.")
     prompt = Prompt.query.get_or_404(prompt_id)
-    if not prompt.is_shared and prompt.user_id != current_user.id:
+    if not prompt.visible_to(current_user.id):
         return jsonify({'message': 'Access forbidden!'}), 403
-    history = [gen_prompt.to_dict() for gen_prompt in prompt.generated_prompts]
-    logger.info(f"Fetched {len(history)} generated prompts for prompt {prompt_id}.")
-    return jsonify(history)
+    count, last_id = GeneratedPrompt.history_version(prompt_id)
+
+    def build():
+        keys = [(GeneratedPrompt.created_at, True), (GeneratedPrompt.id, True)]
+        try:
+            generations, next_cursor = paginate(GeneratedPrompt.history_query(prompt_id), keys,
+                                                lambda query: [gen.to_summary_dict() for gen in query])
+        except PaginationError as e:
+            return jsonify({'message': str(e)}), 400
+        return jsonify({'generations': generations, 'next_cursor': next_cursor})
+    return conditional(f"history-{prompt_id}-{count}-{last_id}", build)
+
+@api_bp.route('/prompts/<int:prompt_id>/history/<int:generation_id>', methods=['GET'])
+@auth_required
+@read_replica
+def get_generation(current_user, prompt_id, generation_id):
+    prompt = Prompt.query.get_or_404(prompt_id)
+    if not prompt.visible_to(current_user.id):
+        return jsonify({'message': 'Access forbidden!'}), 403
+    generation = GeneratedPrompt.query.filter_by(id=generation_id, prompt_id=prompt_id).first_or_404()
+    # Generations never change once saved
+    return conditional(f"generation-{generation.id}", lambda: jsonify(generation.to_dict()))
+
+@api_bp.route('/leaderboard', methods=['GET'])
+@auth_required
+@read_replica
+def get_leaderboard(current_user):
+    """Public prompts ranked by their average overall score, from PromptStats."""
+    min_generations = request.args.get('min_generations', current_app.config['LEADERBOARD_MIN_GENERATIONS'], type=int)
+    query = PromptStats.query.join(PromptStats.prompt) \
+        .filter(Prompt.is_shared.is_(True), PromptStats.scored_generations >= max(min_generations, 1))
+
+    def serialize(query):
+        rows = query.options(joinedload(PromptStats.prompt).joinedload(Prompt.author)).all()
+        return [dict(stats.to_dict(), prompt=stats.prompt.to_dict()) for stats in rows]
+
+    keys = [(PromptStats.average_score, True), (PromptStats.prompt_id, True)]
+    try:
+        entries, next_cursor = paginate(query, keys, serialize)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
+    return jsonify({'prompts': entries, 'next_cursor': next_cursor})
+
+@api_bp.route('/users/me/stats', methods=['GET'])
+@auth_required
+@read_replica
+def get_my_stats(current_user):
+    stats = db.session.get(UserStats, current_user.id) or UserStats.empty(current_user.id)
+    return jsonify(stats.to_dict())
 
 @api_bp.route('/prompts/<int:prompt_id>/vote', methods=['POST'])
 @auth_required
@@ -306,6 +544,7 @@ def vote_on_prompt(current_user, prompt_id):
     existing_vote = PromptVote.query.filter_by(user_id=current_user.id, prompt_id=prompt.id).first()
 
     if existing_vote:
+        Prompt.apply_vote_change(prompt.id, existing_vote.vote, vote_value)
         if vote_value == 0:
             db.session.delete(existing_vote)
             db.session.commit()
@@ -318,6 +557,7 @@ def vote_on_prompt(current_user, prompt_id):
         if vote_value != 0:
             new_vote = PromptVote(user_id=current_user.id, prompt_id=prompt.id, vote=vote_value)
             db.session.add(new_vote)
+            Prompt.apply_vote_change(prompt.id, 0, vote_value)
             db.session.commit()
             return jsonify({'message': 'Vote recorded.'}), 201
         else:
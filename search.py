@@ -0,0 +1,261 @@
+import re
+import sqlalchemy as sa
+from sqlalchemy import event, func, inspect, or_
+from database import db, Prompt
+from logger import logger
+
+# Descriptive fields covered by the search index, in index column order
+SEARCH_FIELDS = ('title', 'text', 'tags', 'intended_use', 'target_audience', 'expected_outcome')
+
+# Fields that can be filtered on individually through the search endpoint
+FILTER_FIELDS = ('intended_use', 'target_audience')
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value):
+    """Splits free text into the word tokens understood by every backend."""
+    return _TOKEN_RE.findall(value or '')
+
+
+class SearchBackend:
+    """Base class for the full-text search backends.
+
+    A backend owns the search index of shared prompts: it creates the index,
+    keeps it in step with prompt writes and turns search terms into a filter
+    plus a rank column (lower rank sorts first) on a Prompt query.
+    """
+
+    def create_schema(self, connection):
+        pass
+
+    def rebuild(self, connection):
+        pass
+
+    def index(self, connection, prompt):
+        pass
+
+    def index_new(self, connection, prompt_ids):
+        """Indexes prompts inserted in bulk, which bypass the mapper events."""
+        pass
+
+    def remove(self, connection, prompt_id):
+        pass
+
+    def search(self, query, q=None, filters=None):
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(SearchBackend):
+    """Search backed by an FTS5 virtual table holding only shared prompts."""
+
+    table = 'prompt_fts'
+    # bm25 weights, one per column in SEARCH_FIELDS
+    weights = (10.0, 1.0, 5.0, 2.0, 2.0, 1.0)
+
+    def create_schema(self, connection):
+        connection.execute(sa.text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            f"USING fts5({', '.join(SEARCH_FIELDS)}, tokenize = 'porter unicode61')"
+        ))
+        weights = ', '.join(str(w) for w in self.weights)
+        connection.execute(sa.text(
+            f"INSERT INTO {self.table}({self.table}, rank) VALUES ('rank', 'bm25({weights})')"
+        ))
+
+    def rebuild(self, connection):
+        fields = ', '.join(SEARCH_FIELDS)
+        connection.execute(sa.text(f"DELETE FROM {self.table}"))
+        connection.execute(sa.text(
+            f"INSERT INTO {self.table}(rowid, {fields}) "
+            f"SELECT id, {fields} FROM prompt WHERE is_shared"
+        ))
+
+    def index(self, connection, prompt):
+        self.remove(connection, prompt.id)
+        if not prompt.is_shared:
+            return
+        fields = ', '.join(SEARCH_FIELDS)
+        params = ', '.join(f':{field}' for field in SEARCH_FIELDS)
+        connection.execute(
+            sa.text(f"INSERT INTO {self.table}(rowid, {fields}) VALUES (:id, {params})"),
+            dict({field: getattr(prompt, field) for field in SEARCH_FIELDS}, id=prompt.id)
+        )
+
+    def index_new(self, connection, prompt_ids):
+        prompt = Prompt.__table__
+        connection.execute(
+            sa.insert(sa.table(self.table, sa.column('rowid'), *[sa.column(field) for field in SEARCH_FIELDS]))
+            .from_select(['rowid', *SEARCH_FIELDS],
+                         sa.select(prompt.c.id, *[prompt.c[field] for field in SEARCH_FIELDS])
+                         .where(prompt.c.is_shared.is_(True), prompt.c.id.in_(prompt_ids)))
+        )
+
+    def remove(self, connection, prompt_id):
+        connection.execute(sa.text(f"DELETE FROM {self.table} WHERE rowid = :id"), {'id': prompt_id})
+
+    @staticmethod
+    def _phrases(value, prefix=False):
+        tokens = ['"' + token.replace('"', '""') + '"' for token in tokenize(value)]
+        if prefix and tokens:
+            tokens[-1] += '*'
+        return ' '.join(tokens)
+
+    def match_expression(self, q=None, filters=None):
+        """Builds an FTS5 MATCH expression; every term is quoted, never raw."""
+        parts = []
+        phrases = self._phrases(q, prefix=True)
+        if phrases:
+            parts.append(f'({phrases})')
+        for field, value in (filters or {}).items():
+            phrases = self._phrases(value)
+            if phrases:
+                parts.append(f'{field} : ({phrases})')
+        return ' AND '.join(parts)
+
+    def search(self, query, q=None, filters=None):
+        expression = self.match_expression(q, filters)
+        if not expression:
+            return query, None
+        fts = sa.table(self.table, sa.column('rowid'), sa.column('rank'))
+        matches = sa.select(fts.c.rowid.label('prompt_id'), fts.c.rank.label('rank')) \
+            .where(sa.text(f"{self.table} MATCH :match").bindparams(match=expression)) \
+            .subquery()
+        rank = sa.type_coerce(matches.c.rank, sa.Float).label('rank')
+        return query.join(matches, matches.c.prompt_id == Prompt.id), rank
+
+
+class PostgresSearchBackend(SearchBackend):
+    """Search backed by a GIN index over a weighted tsvector expression.
+
+    The index is an expression index created by the migration, so Postgres
+    maintains it on every write and index()/remove() have nothing to do.
+    """
+
+    config = 'english'
+    index_name = 'ix_prompt_search_vector'
+    # tsvector weight of each field, in the order of the index expression
+    weights = {'title': 'A', 'tags': 'B', 'intended_use': 'C', 'target_audience': 'C',
+               'expected_outcome': 'C', 'text': 'D'}
+
+    @classmethod
+    def regconfig(cls):
+        return sa.literal_column(f"'{cls.config}'::regconfig")
+
+    @classmethod
+    def vector(cls, table=None):
+        columns = table.c if table is not None else Prompt.__table__.c
+        vectors = [
+            func.setweight(func.to_tsvector(cls.regconfig(), func.coalesce(columns[field], '')), weight)
+            for field, weight in cls.weights.items()
+        ]
+        vector = vectors[0]
+        for other in vectors[1:]:
+            vector = vector.op('||')(other)
+        return vector
+
+    def create_schema(self, connection):
+        ddl = sa.schema.CreateIndex(
+            sa.Index(self.index_name, self.vector(), postgresql_using='gin'),
+            if_not_exists=True,
+        )
+        connection.execute(ddl)
+
+    def field_filter(self, field, value):
+        """Matches every word of `value` within one field.
+
+        The indexed vector only records a lexeme's weight, which the filter
+        fields share with expected_outcome, so the weighted match narrows the rows
+        through the GIN index and the field's own tsvector rechecks them.
+        """
+        tokens = tokenize(value)
+        if not tokens:
+            return None
+        weight = self.weights[field]
+        # Tokens are plain word characters, so quoting them is enough to keep
+        # the tsquery syntax out of user input
+        weighted = func.to_tsquery(self.regconfig(), ' & '.join(f"'{token}':{weight}" for token in tokens))
+        column = func.to_tsvector(self.regconfig(), func.coalesce(getattr(Prompt, field), ''))
+        return sa.and_(self.vector().op('@@')(weighted),
+                       column.op('@@')(func.plainto_tsquery(self.regconfig(), ' '.join(tokens))))
+
+    def search(self, query, q=None, filters=None):
+        for field, value in (filters or {}).items():
+            condition = self.field_filter(field, value)
+            if condition is not None:
+                query = query.filter(condition)
+        if not tokenize(q):
+            return query, None
+        tsquery = func.websearch_to_tsquery(self.regconfig(), q)
+        vector = self.vector()
+        query = query.filter(vector.op('@@')(tsquery))
+        return query, (-func.ts_rank(vector, tsquery)).label('rank')
+
+
+class LikeSearchBackend(SearchBackend):
+    """Unindexed fallback for databases without a supported text index."""
+
+    def search(self, query, q=None, filters=None):
+        for token in tokenize(q):
+            query = query.filter(or_(*[getattr(Prompt, field).ilike(f'%{token}%') for field in SEARCH_FIELDS]))
+        for field, value in (filters or {}).items():
+            for token in tokenize(value):
+                query = query.filter(getattr(Prompt, field).ilike(f'%{token}%'))
+        return query, None
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backends = {}
+
+
+def get_backend(dialect_name=None):
+    """Returns the search backend for a dialect (default: the app's engine)."""
+    if dialect_name is None:
+        dialect_name = db.engine.dialect.name
+    if dialect_name not in _backends:
+        _backends[dialect_name] = BACKENDS.get(dialect_name, LikeSearchBackend)()
+    return _backends[dialect_name]
+
+
+def search_prompts(query, q=None, filters=None):
+    """Applies the full-text search to a Prompt query.
+
+    Returns `(query, rank)`; `rank` is None when there was nothing to rank on.
+    """
+    return get_backend().search(query, q=q, filters=filters)
+
+
+def rebuild_index():
+    """Recreates the search index from the shared prompts."""
+    with db.engine.begin() as connection:
+        backend = get_backend(connection.dialect.name)
+        backend.create_schema(connection)
+        backend.rebuild(connection)
+    logger.info("Search index rebuilt.")
+
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_schema(target, connection, **kw):
+    get_backend(connection.dialect.name).create_schema(connection)
+
+
+@event.listens_for(Prompt, 'after_insert')
+def _index_new_prompt(mapper, connection, target):
+    get_backend(connection.dialect.name).index(connection, target)
+
+
+@event.listens_for(Prompt, 'after_update')
+def _reindex_prompt(mapper, connection, target):
+    state = inspect(target)
+    fields = SEARCH_FIELDS + ('is_shared',)
+    if any(state.attrs[field].history.has_changes() for field in fields):
+        get_backend(connection.dialect.name).index(connection, target)
+
+
+@event.listens_for(Prompt, 'after_delete')
+def _unindex_prompt(mapper, connection, target):
+    get_backend(connection.dialect.name).remove(connection, target.id)
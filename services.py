@@ -1,14 +1,501 @@
+import asyncio
 import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 import google.generativeai as genai
+from flask import current_app
+from database import db, GeneratedPrompt, UserTokenUsage
+from coalesce import get_coalescer
+from generation_cache import cache_key, get_generation_cache
+from logger import logger
+from ratelimit import get_model_rate_limit
+from tokens import PromptTooLarge, QuotaExceeded, TokenBudgetError, get_token_budget
+from metrics import metrics
+from parsing import ResponseFormatError, StringFieldStreamer, extract_json_object, validate_response
+
+MODEL_NAME = 'gemini-2.5-pro'
+
+
+class GenerationError(Exception):
+    """Raised when a model call fails or returns an unusable response."""
+
+    def __init__(self, message, raw_response=None, retryable=True):
+        super().__init__(message)
+        self.raw_response = raw_response
+        self.retryable = retryable
+
+
+class FakeUsageMetadata:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeStreamResponse:
+    def __init__(self, text, usage_metadata, delay):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self._delay = delay
+
+    def __iter__(self):
+        for start in range(0, len(self.text), 40):
+            time.sleep(self._delay)
+            yield FakeChunk(self.text[start:start + 40])
+
+
+class FakeModel:
+    """Offline stand-in for the Gemini model, used for local load testing.
+
+    Enabled with PROMPTIFY_FAKE_MODEL=1; each call sleeps for
+    FAKE_MODEL_LATENCY seconds and returns a well-formed analysis.
+    """
+
+    def __init__(self, latency=1.0):
+        self.latency = latency
+
+    async def generate_content_async(self, contents, generation_config=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._response(contents, generation_config)
+
+    def generate_content(self, contents, stream=False, generation_config=None, **kwargs):
+        if stream:
+            response = self._response(contents)
+            # Spread the latency over the chunks, like a streamed response
+            delay = self.latency * 40 / len(response.text)
+            return FakeStreamResponse(response.text, response.usage_metadata, delay)
+        time.sleep(self.latency)
+        return self._response(contents, generation_config)
+
+    def _response(self, contents, generation_config=None):
+        payload = {
+            'title': 'Fake generation',
+            'analysis': {
+                'overall_score': 7,
+                'clarity': 7,
+                'specificity': 6,
+                'effectiveness': 8,
+                'improvements_made': ['Clarified the requested output format.'],
+                'additional_suggestions': ['Provide an example of the expected output.'],
+            },
+            'refined_prompt': contents.rsplit('---', 2)[-2].strip(),
+            'generated_content': f'Fake content for a prompt of {len(contents)} characters.',
+        }
+        text = json.dumps(payload)
+        if (generation_config or {}).get('response_mime_type') != 'application/json':
+            text = '```json\n' + text + '\n```'
+        return FakeResponse(text, FakeUsageMetadata(len(contents) // 4, len(text) // 4))
+
 
 model = None
 api_key = os.environ.get("GOOGLE_API_KEY")
 
-if not api_key:
+if os.environ.get("PROMPTIFY_FAKE_MODEL"):
+    model = FakeModel(latency=float(os.environ.get("FAKE_MODEL_LATENCY", 1.0)))
+elif not api_key:
     print("Warning: GOOGLE_API_KEY environment variable not set. The generate endpoint will not work.")
 else:
     try:
         genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-pro')
+        model = genai.GenerativeModel(MODEL_NAME)
     except Exception as e:
         print(f"Error configuring Google Gemini AI: {e}")
+
+
+def build_system_prompt(prompt, text=None):
+    """Renders the analysis instructions for a prompt.
+
+    `text` replaces the prompt's own text, e.g. when it had to be truncated.
+    """
+    # Build the prompt text from the prompt's attributes
+    user_prompt_text = f"""
+    Prompt: {prompt.text if text is None else text}
+    Intended Use: {prompt.intended_use}
+    Target Audience: {prompt.target_audience}
+    Expected Outcome: {prompt.expected_outcome}
+    """
+
+    system_prompt = f"""
+    You are a prompt engineering expert. Your task is to analyze a user's prompt and then generate a response based on a refined version of that prompt.
+    Please analyze the following user prompt and provide a response in a single JSON object with the following structure:
+    {{
+      "title": "<A concise title for the prompt, maximum 25 characters>",
+      "analysis": {{
+        "overall_score": <an integer score out of 10 for the prompt>,
+        "clarity": <an integer score out of 10>,
+        "specificity": <an integer score out of 10>,
+        "effectiveness": <an integer score out of 10>,
+        "improvements_made": ["<a list of strings describing improvements made>"],
+        "additional_suggestions": ["<a list of strings for further suggestions>"]
+      }},
+      "refined_prompt": "<your refined version of the user's prompt>",
+      "generated_content": "<the content generated by executing the refined prompt>"
+    }}
+
+    Here is the user's prompt to analyze:
+    ---
+    {user_prompt_text.strip()}
+    ---
+    """
+    return system_prompt.strip()
+
+
+def render_system_prompt(prompt):
+    """Renders the system prompt for a generation within the prompt size limit.
+
+    Returns `(system_prompt, estimated_tokens)`. Oversized prompts raise
+    PromptTooLarge, or have their text cut to fit when the oversize policy
+    is 'truncate'.
+    """
+    budget = get_token_budget()
+    system_prompt = build_system_prompt(prompt)
+    estimated = budget.estimator.estimate(system_prompt)
+    if estimated <= budget.max_prompt_tokens:
+        return system_prompt, estimated
+    overhead = budget.estimator.estimate(build_system_prompt(prompt, text=''))
+    if budget.oversize_policy != 'truncate' or overhead >= budget.max_prompt_tokens:
+        raise PromptTooLarge(estimated, budget.max_prompt_tokens)
+    text = budget.estimator.truncate(prompt.text, budget.max_prompt_tokens - overhead)
+    system_prompt = build_system_prompt(prompt, text=text)
+    logger.info(f"Truncated prompt {prompt.id} from about {estimated} tokens to fit {budget.max_prompt_tokens}.")
+    return system_prompt, budget.estimator.estimate(system_prompt)
+
+
+# Requested on a second attempt when a free-form response could not be parsed
+JSON_GENERATION_CONFIG = {'response_mime_type': 'application/json'}
+
+
+def parse_response(text):
+    """Extracts the JSON object from a model response and validates it.
+
+    The object may be surrounded by markdown fences or prose.
+    """
+    try:
+        data = validate_response(extract_json_object(text))
+    except ResponseFormatError as e:
+        metrics.increment('model_response_parse_failures_total', reason=e.reason)
+        raise GenerationError(f"The AI model returned an unusable response: {e}", raw_response=text)
+    metrics.increment('model_responses_parsed_total')
+    return data
+
+
+def response_usage(response, usage=None):
+    """Returns the token usage of a response, added to that of earlier attempts."""
+    usage = usage or {'prompt_token_count': 0, 'candidates_token_count': 0}
+    return {
+        'prompt_token_count': usage['prompt_token_count'] + response.usage_metadata.prompt_token_count,
+        'candidates_token_count': usage['candidates_token_count'] + response.usage_metadata.candidates_token_count,
+    }
+
+
+def parse_json_mode_response(response, usage):
+    """Parses the response to a JSON-mode retry, counting both attempts."""
+    logger.info(f"Raw JSON-mode response from Gemini: {response.text}")
+    try:
+        data = parse_response(response.text)
+    except GenerationError:
+        metrics.increment('model_json_fallbacks_total', result='failed')
+        raise
+    metrics.increment('model_json_fallbacks_total', result='succeeded')
+    return data, response_usage(response, usage)
+
+
+def call_model_json(system_prompt, usage):
+    """Asks the model again with JSON output enforced."""
+    logger.warning("Model response could not be parsed, retrying in JSON mode.")
+    response = model.generate_content(system_prompt, generation_config=JSON_GENERATION_CONFIG)
+    return parse_json_mode_response(response, usage)
+
+
+def call_model(system_prompt):
+    """Calls the model and returns the parsed response and its token usage."""
+    if not model:
+        raise GenerationError("Generative model not available. Check GOOGLE_API_KEY.", retryable=False)
+    response = model.generate_content(system_prompt)
+    logger.info(f"Raw response from Gemini: {response.text}")
+    usage = response_usage(response)
+    try:
+        return parse_response(response.text), usage
+    except GenerationError:
+        return call_model_json(system_prompt, usage)
+
+
+async def call_model_async(system_prompt):
+    """Awaitable variant of call_model for the native ASGI mode."""
+    if not model:
+        raise GenerationError("Generative model not available. Check GOOGLE_API_KEY.", retryable=False)
+    response = await model.generate_content_async(system_prompt)
+    logger.info(f"Raw response from Gemini: {response.text}")
+    usage = response_usage(response)
+    try:
+        return parse_response(response.text), usage
+    except GenerationError:
+        logger.warning("Model response could not be parsed, retrying in JSON mode.")
+    response = await model.generate_content_async(system_prompt, generation_config=JSON_GENERATION_CONFIG)
+    return parse_json_mode_response(response, usage)
+
+
+def save_generation(prompt, data, usage, from_cache=False, user_id=None, reservation=None):
+    """Adds the GeneratedPrompt for a parsed model response to the session.
+
+    The tokens are added to the user's daily usage unless it was served
+    from the cache; either way the `reservation` made for the model call is
+    released in the same transaction.
+    """
+    new_generated_prompt = build_generation(prompt, data, usage, from_cache=from_cache, user_id=user_id)
+    db.session.add(new_generated_prompt)
+    if user_id is not None and not from_cache:
+        UserTokenUsage.record(user_id, usage, reservation=reservation)
+    elif reservation is not None:
+        UserTokenUsage.release(user_id, reservation)
+    return new_generated_prompt
+
+
+def build_generation(prompt, data, usage, from_cache=False, user_id=None):
+    """Creates the GeneratedPrompt for a parsed model response."""
+    analysis = data.get('analysis') or {}
+
+    # If the prompt doesn't have a title, update it with the generated one
+    generated_title = data.get('title')
+    if generated_title and not prompt.title:
+        prompt.title = generated_title[:25] # Enforce max length
+
+    new_generated_prompt = GeneratedPrompt(
+        prompt_id=prompt.id,
+        user_id=user_id,
+        generated_text=data.get('generated_content'),
+        prompt_token_count=0 if from_cache else usage['prompt_token_count'],
+        candidates_token_count=0 if from_cache else usage['candidates_token_count'],
+        from_cache=from_cache,
+        overall_score=analysis.get('overall_score'),
+        clarity=analysis.get('clarity'),
+        specificity=analysis.get('specificity'),
+        effectiveness=analysis.get('effectiveness'),
+        refined_prompt=data.get('refined_prompt'),
+        improvements_made=analysis.get('improvements_made'),
+        additional_suggestions=analysis.get('additional_suggestions')
+    )
+    return new_generated_prompt
+
+
+def generate_from_cache(prompt, user_id=None):
+    """Saves a GeneratedPrompt from the generation cache, if there is a hit.
+
+    Returns None on a cache miss.
+    """
+    system_prompt, _ = render_system_prompt(prompt)
+    cached = get_generation_cache().get(cache_key(system_prompt, MODEL_NAME))
+    if cached is None:
+        return None
+    data, usage = cached
+    generated_prompt = save_generation(prompt, data, usage, from_cache=True, user_id=user_id)
+    db.session.commit()
+    logger.info(f"Served generation for prompt {prompt.id} from the cache.")
+    return generated_prompt
+
+
+def begin_generation(prompt, fresh=False, user_id=None):
+    """Runs the steps of a generation before its model call.
+
+    Returns `(generated_prompt, None, None)` when it was served from the
+    cache, or `(None, system_prompt, reservation)` once the token budget
+    reserved the tokens of the model call. The reservation is None without a
+    quota; it must be given to finish_generation(), or back to the budget if
+    the call fails.
+    """
+    if not fresh:
+        generated_prompt = generate_from_cache(prompt, user_id=user_id)
+        if generated_prompt is not None:
+            return generated_prompt, None, None
+
+    system_prompt, estimated = render_system_prompt(prompt)
+    reservation = None
+    if user_id is not None:
+        reservation = get_token_budget().reserve(user_id, estimated)
+    return None, system_prompt, reservation
+
+
+def finish_generation(prompt, data, usage, leader, user_id=None, reservation=None):
+    """Commits the GeneratedPrompt of a model call; only its leader is charged."""
+    generated_prompt = save_generation(prompt, data, usage, from_cache=not leader, user_id=user_id,
+                                       reservation=reservation)
+    db.session.commit()
+    logger.info(f"Content generated and saved for prompt {prompt.id}.")
+    return generated_prompt
+
+
+def generate_for_prompt(prompt, fresh=False, user_id=None):
+    """Runs a generation for a prompt and commits the resulting GeneratedPrompt.
+
+    The response is looked up in the generation cache first unless `fresh`
+    is set; fresh responses are always written back to the cache. Callers
+    that joined another request's in-flight call get its response. Model
+    calls are charged to `user_id` and checked against its daily quota.
+    """
+    generated_prompt, system_prompt, reservation = begin_generation(prompt, fresh=fresh, user_id=user_id)
+    if generated_prompt is not None:
+        return generated_prompt
+    key = cache_key(system_prompt, MODEL_NAME)
+
+    def call_and_cache():
+        data, usage = call_model(system_prompt)
+        get_generation_cache().put(key, MODEL_NAME, data, usage)
+        return data, usage
+
+    try:
+        # Identical concurrent generations share a single model call; only the
+        # caller that made it is charged for the tokens
+        data, usage, leader = get_coalescer().run(key, call_and_cache)
+        return finish_generation(prompt, data, usage, leader, user_id=user_id, reservation=reservation)
+    except Exception:
+        db.session.rollback()
+        get_token_budget().release(user_id, reservation)
+        raise
+
+
+def generate_batch(prompts, fresh=False, concurrency=8, user_id=None):
+    """Runs generations for several prompts at once.
+
+    Cache lookups happen up front; the remaining model calls run on up to
+    `concurrency` threads, within the model rate limit and coalesced like
+    single generations, so prompts with identical content share one call.
+    Calls that would go over the user's daily quota are not made. All
+    GeneratedPrompt rows are then inserted in a single commit. Returns a
+    dict mapping each prompt id to its GeneratedPrompt or to the exception
+    that made it fail.
+    """
+    app = current_app._get_current_object()
+    system_prompts = {}
+    estimates = {}
+    prompt_keys = {}
+    results = {}
+    for prompt in prompts:
+        try:
+            system_prompt, estimated = render_system_prompt(prompt)
+        except TokenBudgetError as e:
+            results[prompt.id] = e
+            continue
+        prompt_keys[prompt.id] = key = cache_key(system_prompt, MODEL_NAME)
+        system_prompts[key] = system_prompt
+        estimates[key] = estimated
+
+    responses = {}
+    if not fresh:
+        generation_cache = get_generation_cache()
+        for key in system_prompts:
+            cached = generation_cache.get(key)
+            if cached is not None:
+                responses[key] = (*cached, False)
+
+    def run(key):
+        with app.app_context():
+            def call_and_cache():
+                get_model_rate_limit().acquire()
+                data, usage = call_model(system_prompts[key])
+                get_generation_cache().put(key, MODEL_NAME, data, usage)
+                return data, usage
+            return get_coalescer().run(key, call_and_cache)
+
+    missing = [key for key in system_prompts if key not in responses]
+    errors = {}
+    budget = get_token_budget()
+    reservations = {}
+    if user_id is not None:
+        allowed = []
+        for key in missing:
+            try:
+                reservations[key] = budget.reserve(user_id, estimates[key])
+            except QuotaExceeded as e:
+                errors[key] = e
+                continue
+            allowed.append(key)
+        missing = allowed
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(missing)), thread_name_prefix='batch') as executor:
+            futures = {key: executor.submit(run, key) for key in missing}
+            for key, future in futures.items():
+                try:
+                    responses[key] = future.result()
+                except Exception as e:
+                    logger.error(f"Batch generation failed ({key[:12]}): {e}")
+                    errors[key] = e
+                    budget.release(user_id, reservations.pop(key, None))
+
+    # Only the first prompt served by a fresh model call is charged for it
+    for prompt in prompts:
+        key = prompt_keys.get(prompt.id)
+        if key is None:
+            continue
+        if key in errors:
+            results[prompt.id] = errors[key]
+            continue
+        data, usage, leader = responses[key]
+        results[prompt.id] = save_generation(prompt, data, usage, from_cache=not leader, user_id=user_id,
+                                             reservation=reservations.pop(key, None))
+        responses[key] = (data, usage, False)
+    db.session.commit()
+    succeeded = sum(not isinstance(result, Exception) for result in results.values())
+    logger.info(f"Batch generated content for {succeeded} of {len(prompts)} prompts.")
+    return results
+
+
+def stream_generation(prompt, fresh=False, user_id=None):
+    """Streams a generation for a prompt.
+
+    Yields `('delta', text)` events with the parts of `generated_content` as
+    the model produces them, then a final `('done', generated_prompt)` once
+    the full response has been parsed, cached and committed.
+    """
+    system_prompt, estimated = render_system_prompt(prompt)
+    key = cache_key(system_prompt, MODEL_NAME)
+    cached = None if fresh else get_generation_cache().get(key)
+    if cached is not None:
+        data, usage = cached
+        yield 'delta', data.get('generated_content') or ''
+        generated_prompt = save_generation(prompt, data, usage, from_cache=True, user_id=user_id)
+        db.session.commit()
+        yield 'done', generated_prompt
+        return
+
+    if not model:
+        raise GenerationError("Generative model not available. Check GOOGLE_API_KEY.", retryable=False)
+    budget = get_token_budget()
+    reservation = budget.reserve(user_id, estimated) if user_id is not None else None
+    try:
+        response = model.generate_content(system_prompt, stream=True)
+        streamer = StringFieldStreamer('generated_content')
+        chunks = []
+        for chunk in response:
+            chunks.append(chunk.text)
+            delta = streamer.feed(chunk.text)
+            if delta:
+                yield 'delta', delta
+
+        raw_response = ''.join(chunks)
+        logger.info(f"Raw streamed response from Gemini: {raw_response}")
+        usage = response_usage(response)
+        try:
+            data = parse_response(raw_response)
+        except GenerationError:
+            data, usage = call_model_json(system_prompt, usage)
+        get_generation_cache().put(key, MODEL_NAME, data, usage)
+        generated_prompt = save_generation(prompt, data, usage, user_id=user_id, reservation=reservation)
+        db.session.commit()
+    except BaseException:
+        # Also when the client went away mid-stream (GeneratorExit)
+        db.session.rollback()
+        budget.release(user_id, reservation)
+        raise
+    logger.info(f"Streamed content generated and saved for prompt {prompt.id}.")
+    yield 'done', generated_prompt
@@ -0,0 +1,170 @@
+import math
+import re
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy.orm import Session
+from database import db, GeneratedPrompt, Prompt, UserTokenUsage
+from logger import logger
+
+# Words and single punctuation marks; the model's tokenizer splits roughly
+# along these, with a calibrated number of tokens per piece
+_PIECE = re.compile(r'\w+|[^\w\s]')
+
+
+class TokenBudgetError(Exception):
+    """Raised before a model call that the token budget does not allow."""
+    retryable = False
+
+
+class PromptTooLarge(TokenBudgetError):
+    def __init__(self, estimated, limit):
+        super().__init__(f"The prompt is too large: about {estimated} tokens, the limit is {limit}.")
+        self.estimated = estimated
+        self.limit = limit
+
+
+class QuotaExceeded(TokenBudgetError):
+    def __init__(self, used, quota):
+        super().__init__(f"Daily token quota exceeded: {used} of {quota} tokens used today.")
+        self.used = used
+        self.quota = quota
+
+    @property
+    def retry_after(self):
+        """Seconds until the quota resets at midnight UTC."""
+        now = datetime.utcnow()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        return math.ceil((midnight - now).total_seconds())
+
+
+class TokenEstimator:
+    """Offline approximation of the model's prompt token count.
+
+    Counts words and punctuation marks and scales them by a tokens-per-piece
+    ratio, calibrated against the prompt_token_count the model reported for
+    recent generations. Calibration is redone every `interval` seconds.
+    """
+
+    def __init__(self, default_ratio=1.3, sample_size=200, interval=3600):
+        self.ratio = default_ratio
+        self.sample_size = sample_size
+        self.interval = interval
+        self._calibrated_at = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def count_pieces(text):
+        return sum(1 for _ in _PIECE.finditer(text))
+
+    def estimate(self, text):
+        self._maybe_calibrate()
+        return math.ceil(self.count_pieces(text) * self.ratio)
+
+    def truncate(self, text, max_tokens):
+        """Cuts `text` after the last piece that fits in `max_tokens`."""
+        self._maybe_calibrate()
+        max_pieces = int(max_tokens / self.ratio)
+        end = 0
+        for i, match in enumerate(_PIECE.finditer(text)):
+            if i == max_pieces:
+                break
+            end = match.end()
+        return text[:end]
+
+    def _maybe_calibrate(self):
+        if self._calibrated_at is not None and time.monotonic() - self._calibrated_at < self.interval:
+            return
+        with self._lock:
+            if self._calibrated_at is None or time.monotonic() - self._calibrated_at >= self.interval:
+                self.calibrate()
+
+    def calibrate(self):
+        """Sets the ratio to the median over recent model-charged generations."""
+        from services import build_system_prompt
+        self._calibrated_at = time.monotonic()
+        rows = db.session.query(Prompt, GeneratedPrompt.prompt_token_count) \
+            .join(GeneratedPrompt, GeneratedPrompt.prompt_id == Prompt.id) \
+            .filter(GeneratedPrompt.from_cache.is_(False), GeneratedPrompt.prompt_token_count > 0) \
+            .order_by(GeneratedPrompt.id.desc()) \
+            .limit(self.sample_size).all()
+        ratios = []
+        for prompt, token_count in rows:
+            pieces = self.count_pieces(build_system_prompt(prompt))
+            if pieces:
+                ratios.append(token_count / pieces)
+        if ratios:
+            # The median ignores prompts edited since they were generated
+            self.ratio = statistics.median(ratios)
+            logger.info(f"Calibrated the token estimator on {len(ratios)} generations: {self.ratio:.3f} tokens per piece.")
+
+
+class TokenBudget:
+    """Pre-flight limits on what a generation may spend.
+
+    Prompts estimated above `max_prompt_tokens` are rejected, or truncated
+    when `oversize_policy` is 'truncate'. Each user may be charged at most
+    `daily_quota` tokens per UTC day (0 disables the quota), checked against
+    the UserTokenUsage rollup. A model call must fit its estimated prompt
+    plus `completion_reserve` tokens for the response; that much is reserved
+    until the call's actual usage is recorded, so concurrent calls cannot
+    overrun the quota together.
+    """
+
+    def __init__(self, app):
+        config = app.config
+        self.max_prompt_tokens = config['MAX_PROMPT_TOKENS']
+        self.oversize_policy = config['PROMPT_OVERSIZE_POLICY']
+        self.daily_quota = config['DAILY_TOKEN_QUOTA']
+        self.completion_reserve = config['COMPLETION_TOKEN_RESERVE']
+        self.estimator = TokenEstimator(
+            sample_size=config['TOKEN_CALIBRATION_SAMPLE'],
+            interval=config['TOKEN_CALIBRATION_INTERVAL'],
+        )
+
+    def remaining(self, user_id, session=None):
+        """Tokens the user may still spend today, or None without a quota."""
+        if not self.daily_quota:
+            return None
+        used = UserTokenUsage.used_on(user_id, datetime.utcnow().date(), session=session)
+        return self.daily_quota - used
+
+    def check_quota(self, user_id, estimated, session=None):
+        """Rejects a call that would not fit in the quota, without reserving it."""
+        remaining = self.remaining(user_id, session=session)
+        if remaining is not None and estimated + self.completion_reserve > remaining:
+            raise QuotaExceeded(self.daily_quota - remaining, self.daily_quota)
+
+    def reserve(self, user_id, estimated):
+        """Reserves the tokens of a model call, in a transaction of its own.
+
+        Returns the reservation to pass to UserTokenUsage.record() with the
+        call's usage, or to release() if no usage gets recorded; None without
+        a quota. Raises QuotaExceeded when the call does not fit.
+        """
+        if not self.daily_quota:
+            return None
+        day = datetime.utcnow().date()
+        tokens = estimated + self.completion_reserve
+        with Session(db.engine) as session, session.begin():
+            if UserTokenUsage.reserve(user_id, day, tokens, self.daily_quota, session=session):
+                return day, tokens
+            used = UserTokenUsage.used_on(user_id, day, session=session)
+        raise QuotaExceeded(used, self.daily_quota)
+
+    def release(self, user_id, reservation):
+        """Gives back a reservation whose call failed, in a transaction of its own."""
+        if reservation is None:
+            return
+        with Session(db.engine) as session, session.begin():
+            UserTokenUsage.release(user_id, reservation, session=session)
+
+
+def init_app(app):
+    app.extensions['token_budget'] = TokenBudget(app)
+
+
+def get_token_budget():
+    return current_app.extensions['token_budget']
@@ -0,0 +1,212 @@
+import json
+from datetime import datetime, timezone
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from database import db, CatalogueVersion, Prompt, Tag, hot_score, parse_tags, prompt_tags
+from search import get_backend
+from logger import logger
+
+# Text fields of an exported prompt, with the longest value accepted on import
+TEXT_FIELDS = {
+    'title': 255,
+    'text': None,
+    'intended_use': 200,
+    'target_audience': 200,
+    'expected_outcome': 200,
+    'tags': 200,
+}
+EXPORT_COLUMNS = ('id', *TEXT_FIELDS, 'is_shared', 'created_at')
+
+
+def export_prompts(user_id, batch_size=1000):
+    """Yields the prompts of a user as NDJSON, oldest first, one chunk per batch.
+
+    Rows are streamed from the database `batch_size` at a time as plain
+    tuples, so memory use does not grow with the number of prompts.
+    """
+    statement = select(*[getattr(Prompt, name) for name in EXPORT_COLUMNS]) \
+        .where(Prompt.user_id == user_id).order_by(Prompt.id) \
+        .execution_options(yield_per=batch_size)
+    for rows in db.session.execute(statement).partitions():
+        lines = []
+        for row in rows:
+            record = row._asdict()
+            record['created_at'] = record['created_at'].isoformat()
+            lines.append(json.dumps(record, separators=(',', ':')))
+        yield '\n'.join(lines) + '\n'
+
+
+def iter_lines(stream, block_size=64 * 1024):
+    """Splits a binary stream into lines, reading it in large blocks.
+
+    Much faster than iterating the request stream, which reads each line in
+    small pieces.
+    """
+    pending = b''
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def parse_line(line):
+    """Validates one NDJSON line into the column values of a new prompt.
+
+    Raises ValueError describing the first problem found. An `id` field is
+    ignored, so exports can be imported as they are.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('Expected a JSON object.')
+    values = {}
+    for field, max_length in TEXT_FIELDS.items():
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            raise ValueError(f"'{field}' must be a string.")
+        if value and max_length and len(value) > max_length:
+            raise ValueError(f"'{field}' is longer than {max_length} characters.")
+        values[field] = value
+    if not values['text']:
+        raise ValueError("'text' is required.")
+    values['title'] = values['title'] or ''
+
+    values['is_shared'] = record.get('is_shared', False)
+    if not isinstance(values['is_shared'], bool):
+        raise ValueError("'is_shared' must be a boolean.")
+    created_at = record.get('created_at')
+    if created_at is not None:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            raise ValueError("'created_at' must be an ISO 8601 date.")
+        if created_at.tzinfo is not None:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    values['created_at'] = created_at
+    return values
+
+
+class PromptImporter:
+    """Creates a user's prompts from NDJSON lines with chunked bulk inserts.
+
+    Valid lines are inserted `chunk_size` at a time, each chunk in its own
+    transaction; a line that fails validation is reported and skipped, and a
+    chunk the database rejects is retried line by line, so that only the
+    offending lines fail.
+    Bulk inserts bypass the Prompt mapper events, so the tags, search index,
+    hot score and catalogue version are maintained here.
+    """
+
+    def __init__(self, user_id, chunk_size=1000, max_errors=100):
+        self.user_id = user_id
+        self.chunk_size = chunk_size
+        self.max_errors = max_errors
+        self.imported = 0
+        self.shared = 0
+        self.failed = 0
+        self.errors = []
+
+    def run(self, lines):
+        """Imports an iterable of lines (bytes or str) and returns the summary."""
+        chunk = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                chunk.append((number, parse_line(line)))
+            except ValueError as e:
+                self.fail(number, str(e))
+                continue
+            if len(chunk) >= self.chunk_size:
+                self.insert(chunk)
+                chunk = []
+        if chunk:
+            self.insert(chunk)
+        return {'imported': self.imported, 'failed': self.failed, 'errors': self.errors}
+
+    def fail(self, number, message):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': number, 'error': message})
+
+    def insert(self, chunk):
+        try:
+            shared = self.write(chunk)
+            if shared:
+                CatalogueVersion.bump(db.session)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.warning(f"Failed to import {len(chunk)} prompts at once for user {self.user_id}, "
+                           f"retrying them one by one: {e}")
+            self.insert_each(chunk)
+            return
+        self.imported += len(chunk)
+        self.shared += shared
+
+    def insert_each(self, chunk):
+        """Inserts a chunk the database rejected line by line, each in a savepoint.
+
+        The good lines are imported; each failing one is reported with the
+        database's error.
+        """
+        saved, shared = [], 0
+        for number, values in chunk:
+            try:
+                with db.session.begin_nested():
+                    shared += self.write([(number, values)])
+            except SQLAlchemyError as e:
+                self.fail(number, f'The prompt could not be saved: {getattr(e, "orig", e)}')
+                continue
+            saved.append(number)
+        try:
+            if shared:
+                CatalogueVersion.bump(db.session)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"Failed to import {len(saved)} prompts for user {self.user_id}: {e}")
+            for number in saved:
+                self.fail(number, 'The prompt could not be saved.')
+            return
+        self.imported += len(saved)
+        self.shared += shared
+
+    def write(self, chunk):
+        """Inserts the prompts of a chunk in the current transaction; returns how many are shared."""
+        now = datetime.utcnow()
+        rows = []
+        for _, values in chunk:
+            created_at = values['created_at'] or now
+            rows.append(dict(
+                values,
+                user_id=self.user_id,
+                created_at=created_at,
+                updated_at=now,
+                hot_score=hot_score(0, created_at, now) if values['is_shared'] else 0,
+            ))
+        shared = sum(1 for row in rows if row['is_shared'])
+        # Returning the tags with each id avoids sort_by_parameter_order,
+        # which SQLite can only honour by inserting row by row
+        inserted = db.session.execute(insert(Prompt).returning(Prompt.id, Prompt.tags), rows).all()
+        self.link_tags(inserted)
+        if shared:
+            get_backend().index_new(db.session.connection(), [prompt_id for prompt_id, _ in inserted])
+        return shared
+
+    @staticmethod
+    def link_tags(inserted):
+        """Links `(prompt id, tag string)` pairs to their normalized tags."""
+        names = [(prompt_id, parse_tags(raw)) for prompt_id, raw in inserted]
+        tags = {tag.name: tag for tag in Tag.get_or_create(sorted({name for _, row in names for name in row}))}
+        if not tags:
+            return
+        db.session.flush()
+        db.session.execute(prompt_tags.insert(), [
+            {'prompt_id': prompt_id, 'tag_id': tags[name].id}
+            for prompt_id, row in names for name in row
+        ])